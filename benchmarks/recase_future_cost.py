@@ -0,0 +1,109 @@
+# -*- coding:utf-8 -*-
+"""
+Compares the best-first search with the A* search using the admissible and the weighted future cost estimates.
+Reports the hypotheses expanded per line, the lines the search gave up on, the lines recased with a lower score than
+the best-first search and the time taken. Exits with status 1 if the admissible estimate lowers any score.
+"""
+import argparse
+import io
+import sys
+from timeit import default_timer
+
+from thot_utils.libs.recase_models import create_recase_decoder
+from thot_utils.libs.recase_models import load_recase_providers
+
+argparser = argparse.ArgumentParser(description=__doc__)
+
+argparser.add_argument(
+    '-r',
+    '--raw',
+    type=str,
+    help='File with raw text in the language of interest, the model is read from <raw>.sqlite',
+    required=True,
+)
+
+argparser.add_argument(
+    '-f',
+    '--file',
+    type=str,
+    help='File with lowercased text to be recased',
+    required=True,
+)
+
+argparser.add_argument(
+    '-n',
+    '--ngrams-length',
+    type=int,
+    help='Order of the language model (2 by default)',
+    default=2,
+)
+
+argparser.add_argument(
+    '--compact',
+    action='store_true',
+    help='Load the models from the compact files stored by thot_recase_precalculate --compact',
+)
+
+argparser.add_argument(
+    '-w',
+    '--weights',
+    type=str,
+    help='Comma separated weights of the weighted estimate (1.05,1.5 by default)',
+    default='1.05,1.5',
+)
+
+
+def run(decoder, lines):
+    # Count the hypotheses taken from the queue
+    expanded = [0]
+    get_hypothesis_to_expand = decoder.get_hypothesis_to_expand
+
+    def counting_get_hypothesis_to_expand(priority_queue, stdict):
+        expanded[0] += 1
+        return get_hypothesis_to_expand(priority_queue, stdict)
+
+    decoder.get_hypothesis_to_expand = counting_get_hypothesis_to_expand
+    start = default_timer()
+    scores = []
+    for word_array in lines:
+        hyp = decoder.obtain_best_hyp(word_array, False)
+        scores.append(None if hyp is None else hyp.score)
+    return scores, expanded[0], default_timer() - start
+
+
+def main():
+    cli_args = argparser.parse_args()
+    translation_model_provider, language_model_provider = load_recase_providers(cli_args.raw, cli_args.compact)
+
+    with io.open(cli_args.file, 'r', encoding='utf-8') as f:
+        lines = [line.split() for line in f if line.strip()]
+
+    settings = [(None, 1.0), ('admissible', 1.0)]
+    settings.extend(('weighted', float(weight)) for weight in cli_args.weights.split(','))
+
+    base_scores = None
+    failed = False
+    print "%-16s %14s %10s %10s %10s" % ('future cost', 'expanded/line', 'gave up', 'worse', 'time (s)')
+    for future_cost, weight in settings:
+        decoder = create_recase_decoder(translation_model_provider, language_model_provider, cli_args.ngrams_length,
+                                        future_cost=future_cost, future_cost_weight=weight)
+        scores, expanded, elapsed = run(decoder, lines)
+        if base_scores is None:
+            base_scores = scores
+        worse = sum(1 for base_score, score in zip(base_scores, scores)
+                    if base_score is not None and score is not None and score < base_score - 1e-9)
+        if future_cost == 'admissible' and worse > 0:
+            failed = True
+        name = future_cost or 'none'
+        if future_cost == 'weighted':
+            name = '%s %g' % (name, weight)
+        print "%-16s %14.1f %10d %10d %10.2f" % (name, expanded / float(len(lines)), scores.count(None), worse,
+                                                 elapsed)
+
+    if failed:
+        print >> sys.stderr, "The admissible estimate lowered the score of some lines"
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# -*- coding:utf-8 -*-
+"""
+Compares the search of whole lines with the windowed search on lines of growing length, built by joining the lines
+of a lowercased file. Reports the time taken per line by both searches and exits with status 1 if the windowed search
+finds a hypothesis with a different score.
+"""
+import argparse
+import io
+import sys
+from timeit import default_timer
+
+from thot_utils.libs.recase_models import create_recase_decoder
+from thot_utils.libs.recase_models import load_recase_providers
+
+argparser = argparse.ArgumentParser(description=__doc__)
+
+argparser.add_argument(
+    '-r',
+    '--raw',
+    type=str,
+    help='File with raw text in the language of interest, the model is read from <raw>.sqlite',
+    required=True,
+)
+
+argparser.add_argument(
+    '-f',
+    '--file',
+    type=str,
+    help='File with lowercased text the long lines are built from',
+    required=True,
+)
+
+argparser.add_argument(
+    '-l',
+    '--lengths',
+    type=str,
+    help='Comma separated lengths in words of the lines (25,50,100,200,400 by default)',
+    default='25,50,100,200,400',
+)
+
+argparser.add_argument(
+    '-n',
+    '--ngrams-length',
+    type=int,
+    help='Order of the language model (2 by default)',
+    default=2,
+)
+
+argparser.add_argument(
+    '--compact',
+    action='store_true',
+    help='Load the models from the compact files stored by thot_recase_precalculate --compact',
+)
+
+
+def get_score(hyp):
+    if hyp is None:
+        return None
+    return hyp.score
+
+
+def main():
+    cli_args = argparser.parse_args()
+    translation_model_provider, language_model_provider = load_recase_providers(cli_args.raw, cli_args.compact)
+    decoder = create_recase_decoder(translation_model_provider, language_model_provider, cli_args.ngrams_length)
+    windowed_decoder = create_recase_decoder(translation_model_provider, language_model_provider,
+                                             cli_args.ngrams_length, windowing=True)
+
+    with io.open(cli_args.file, 'r', encoding='utf-8') as f:
+        words = f.read().split()
+
+    mismatches = 0
+    print "%8s %8s %14s %14s" % ('length', 'windows', 'whole (ms)', 'windowed (ms)')
+    for length in [int(length) for length in cli_args.lengths.split(',')]:
+        if length > len(words):
+            break
+        word_array = words[:length]
+
+        start = default_timer()
+        hyp = decoder.obtain_best_hyp(word_array, False)
+        whole_time = default_timer() - start
+
+        start = default_timer()
+        windowed_hyp = windowed_decoder.obtain_best_hyp(word_array, False)
+        windowed_time = default_timer() - start
+
+        # Every window has its own iteration limit, so only the whole search may fail to finish
+        if hyp is None:
+            print >> sys.stderr, "The whole search exceeded the maximum number of iterations for length %d" % length
+        elif get_score(windowed_hyp) is None or abs(hyp.score - windowed_hyp.score) > 1e-9:
+            print >> sys.stderr, "Scores differ for length %d: %r %r" % (length, hyp.score, get_score(windowed_hyp))
+            mismatches += 1
+        print "%8d %8d %14.1f %14.1f" % (length, len(windowed_decoder.obtain_windows(word_array)), whole_time * 1000,
+                                         windowed_time * 1000)
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
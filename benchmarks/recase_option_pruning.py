@@ -0,0 +1,117 @@
+# -*- coding:utf-8 -*-
+"""
+Measures the effect of pruning the translation options: recases a lowercased file without pruning and with every
+given top-K limit and relative threshold, and reports the expansions scored, the expansions per second, the lines
+recased exactly as without pruning and the lines recased with the same score (the order of the options changes when
+pruning, so hypotheses with the same score may be chosen differently)
+"""
+import argparse
+import io
+from timeit import default_timer
+
+from thot_utils.libs.recase_models import create_recase_decoder
+from thot_utils.libs.recase_models import load_recase_providers
+
+argparser = argparse.ArgumentParser(description=__doc__)
+
+argparser.add_argument(
+    '-r',
+    '--raw',
+    type=str,
+    help='File with raw text in the language of interest, the model is read from <raw>.sqlite',
+    required=True,
+)
+
+argparser.add_argument(
+    '-f',
+    '--file',
+    type=str,
+    help='File with lowercased text to be recased',
+    required=True,
+)
+
+argparser.add_argument(
+    '-n',
+    '--ngrams-length',
+    type=int,
+    help='Order of the language model (2 by default)',
+    default=2,
+)
+
+argparser.add_argument(
+    '--compact',
+    action='store_true',
+    help='Load the models from the compact files stored by thot_recase_precalculate --compact',
+)
+
+argparser.add_argument(
+    '--max-options',
+    type=str,
+    help='Comma separated top-K limits (1,2,3 by default)',
+    default='1,2,3',
+)
+
+argparser.add_argument(
+    '--option-thresholds',
+    type=str,
+    help='Comma separated relative thresholds (0.5,0.1,0.01 by default)',
+    default='0.5,0.1,0.01',
+)
+
+
+def run(decoder, lines):
+    # Count the expansions scored
+    expansions = [0]
+    expand = decoder.expand
+
+    def counting_expand(*args):
+        exp_list = expand(*args)
+        expansions[0] += len(exp_list)
+        return exp_list
+
+    decoder.expand = counting_expand
+    start = default_timer()
+    results = []
+    for word_array in lines:
+        hyp = decoder.obtain_best_hyp(word_array, False)
+        results.append(None if hyp is None else (hyp.data.words, hyp.score))
+    return results, expansions[0], default_timer() - start
+
+
+def is_same_score(expected_result, result):
+    if expected_result is None or result is None:
+        return expected_result is result
+    return abs(expected_result[1] - result[1]) < 1e-9
+
+
+def main():
+    cli_args = argparser.parse_args()
+    translation_model_provider, language_model_provider = load_recase_providers(cli_args.raw, cli_args.compact)
+
+    with io.open(cli_args.file, 'r', encoding='utf-8') as f:
+        lines = [line.split() for line in f if line.strip()]
+
+    settings = [('none', None, None)]
+    settings.extend(('top %s' % max_opts, int(max_opts), None) for max_opts in cli_args.max_options.split(','))
+    settings.extend(('threshold %s' % opt_threshold, None, float(opt_threshold))
+                    for opt_threshold in cli_args.option_thresholds.split(','))
+
+    expected = None
+    print "%-16s %12s %14s %10s %11s %11s" % ('pruning', 'expansions', 'expansions/s', 'time (s)', 'same lines',
+                                              'same score')
+    for name, max_opts, opt_threshold in settings:
+        decoder = create_recase_decoder(translation_model_provider, language_model_provider, cli_args.ngrams_length,
+                                        max_opts=max_opts, opt_threshold=opt_threshold)
+        results, expansions, elapsed = run(decoder, lines)
+        if expected is None:
+            expected = results
+        same = sum(1 for expected_result, result in zip(expected, results) if expected_result == result)
+        same_score = sum(1 for expected_result, result in zip(expected, results)
+                         if is_same_score(expected_result, result))
+        print "%-16s %12d %14.0f %10.2f %10.1f%% %10.1f%%" % (name, expansions, expansions / elapsed, elapsed,
+                                                             100.0 * same / len(lines),
+                                                             100.0 * same_score / len(lines))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# -*- coding:utf-8 -*-
+"""
+Measures the effect of bounding the queue of the search: recases a lowercased file without a limit and with every
+given maximum queue size, and reports the hypotheses expanded per line, the largest queue, the hypotheses dropped by
+histogram pruning, the lines the search gave up on, the lines recased with a lower score than without a limit and
+the time taken
+"""
+import argparse
+import io
+from timeit import default_timer
+
+from thot_utils.libs.recase_models import create_recase_decoder
+from thot_utils.libs.recase_models import load_recase_providers
+
+argparser = argparse.ArgumentParser(description=__doc__)
+
+argparser.add_argument(
+    '-r',
+    '--raw',
+    type=str,
+    help='File with raw text in the language of interest, the model is read from <raw>.sqlite',
+    required=True,
+)
+
+argparser.add_argument(
+    '-f',
+    '--file',
+    type=str,
+    help='File with lowercased text to be recased',
+    required=True,
+)
+
+argparser.add_argument(
+    '-n',
+    '--ngrams-length',
+    type=int,
+    help='Order of the language model (2 by default)',
+    default=2,
+)
+
+argparser.add_argument(
+    '--compact',
+    action='store_true',
+    help='Load the models from the compact files stored by thot_recase_precalculate --compact',
+)
+
+argparser.add_argument(
+    '--max-queue-sizes',
+    type=str,
+    help='Comma separated maximum queue sizes (100,20,5 by default)',
+    default='100,20,5',
+)
+
+
+def run(decoder, lines):
+    # Count the hypotheses taken from the queue and keep the queue of the current line
+    expanded = [0]
+    queues = []
+    get_hypothesis_to_expand = decoder.get_hypothesis_to_expand
+
+    def counting_get_hypothesis_to_expand(priority_queue, stdict):
+        expanded[0] += 1
+        if not queues or queues[-1][0] is not priority_queue:
+            queues.append([priority_queue, 0])
+        queues[-1][1] = max(queues[-1][1], len(priority_queue))
+        return get_hypothesis_to_expand(priority_queue, stdict)
+
+    decoder.get_hypothesis_to_expand = counting_get_hypothesis_to_expand
+    start = default_timer()
+    scores = []
+    for word_array in lines:
+        hyp = decoder.obtain_best_hyp(word_array, False)
+        scores.append(None if hyp is None else hyp.score)
+    elapsed = default_timer() - start
+    max_len = max([length for _, length in queues] or [0])
+    pruned = sum(priority_queue.num_pruned for priority_queue, _ in queues)
+    return scores, expanded[0], max_len, pruned, elapsed
+
+
+def main():
+    cli_args = argparser.parse_args()
+    translation_model_provider, language_model_provider = load_recase_providers(cli_args.raw, cli_args.compact)
+
+    with io.open(cli_args.file, 'r', encoding='utf-8') as f:
+        lines = [line.split() for line in f if line.strip()]
+
+    settings = [None]
+    settings.extend(int(max_queue_size) for max_queue_size in cli_args.max_queue_sizes.split(','))
+
+    base_scores = None
+    print "%-12s %14s %10s %10s %10s %10s %10s" % ('queue size', 'expanded/line', 'max queue', 'pruned', 'gave up',
+                                                   'worse', 'time (s)')
+    for max_queue_size in settings:
+        decoder = create_recase_decoder(translation_model_provider, language_model_provider, cli_args.ngrams_length,
+                                        max_queue_size=max_queue_size)
+        scores, expanded, max_len, pruned, elapsed = run(decoder, lines)
+        if base_scores is None:
+            base_scores = scores
+        worse = sum(1 for base_score, score in zip(base_scores, scores)
+                    if base_score is not None and score is not None and score < base_score - 1e-9)
+        print "%-12s %14.1f %10d %10d %10d %10d %10.2f" % (max_queue_size or 'none', expanded / float(len(lines)),
+                                                           max_len, pruned, scores.count(None), worse, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# -*- coding:utf-8 -*-
+"""
+Stress check of concurrent recasing: the lines of a file are recased sequentially and then by a pool of threads
+sharing a single decoder, and both results are compared. Exits with status 1 if they differ.
+"""
+import argparse
+import io
+import sys
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
+
+from thot_utils.libs.recase_models import create_recase_decoder
+from thot_utils.libs.recase_models import load_recase_providers
+
+argparser = argparse.ArgumentParser(description=__doc__)
+
+argparser.add_argument(
+    '-r',
+    '--raw',
+    type=str,
+    help='File with raw text in the language of interest, the model is read from <raw>.sqlite',
+    required=True,
+)
+
+argparser.add_argument(
+    '-f',
+    '--file',
+    type=str,
+    help='File with lowercased text to be recased',
+    required=True,
+)
+
+argparser.add_argument(
+    '-t',
+    '--threads',
+    type=int,
+    help='Number of threads recasing at the same time (8 by default)',
+    default=8,
+)
+
+argparser.add_argument(
+    '--repeat',
+    type=int,
+    help='Number of times every line is recased by the threads (4 by default)',
+    default=4,
+)
+
+argparser.add_argument(
+    '-n',
+    '--ngrams-length',
+    type=int,
+    help='Order of the language model (2 by default)',
+    default=2,
+)
+
+argparser.add_argument(
+    '--compact',
+    action='store_true',
+    help='Load the models from the compact files stored by thot_recase_precalculate --compact',
+)
+
+
+def main():
+    cli_args = argparser.parse_args()
+    translation_model_provider, language_model_provider = load_recase_providers(cli_args.raw, cli_args.compact)
+    decoder = create_recase_decoder(translation_model_provider, language_model_provider, cli_args.ngrams_length)
+
+    with io.open(cli_args.file, 'r', encoding='utf-8') as f:
+        lines = [line.strip('\n') for line in f]
+
+    def recase_line(line):
+        return decoder.recase_line(line, False)
+
+    start = default_timer()
+    expected = [recase_line(line) for line in lines]
+    sequential_time = default_timer() - start
+
+    pool = ThreadPool(cli_args.threads)
+    try:
+        start = default_timer()
+        results = pool.map(recase_line, lines * cli_args.repeat, chunksize=1)
+        concurrent_time = default_timer() - start
+    finally:
+        pool.terminate()
+
+    mismatches = [idx % len(lines) for idx, result in enumerate(results) if result != expected[idx % len(lines)]]
+    print >> sys.stderr, "Sequential: %d lines in %.3f s" % (len(lines), sequential_time)
+    print >> sys.stderr, "Concurrent: %d lines in %.3f s with %d threads" % (len(results), concurrent_time,
+                                                                             cli_args.threads)
+    if mismatches:
+        print >> sys.stderr, "%d results differ from sequential decoding, first in line %d" % (
+            len(mismatches), mismatches[0] + 1)
+        sys.exit(1)
+    print >> sys.stderr, "All results match sequential decoding"
+
+
+if __name__ == "__main__":
+    main()
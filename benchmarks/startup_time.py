@@ -0,0 +1,58 @@
+# -*- coding:utf-8 -*-
+"""
+Measures the startup time of every console script: the time taken to run `<script> --help` in a new interpreter,
+which imports the script and its dependencies and exits before reading any input
+"""
+import argparse
+import os
+import subprocess
+import sys
+from timeit import default_timer
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'thot_utils', 'bin')
+
+argparser = argparse.ArgumentParser(description=__doc__)
+
+argparser.add_argument(
+    '--repeat',
+    type=int,
+    help='Number of runs of every script, the best and median times are reported (10 by default)',
+    default=10,
+)
+
+argparser.add_argument(
+    'scripts',
+    nargs='*',
+    help='Scripts to measure (all of them by default)',
+)
+
+
+def get_scripts():
+    return sorted(filename[:-3] for filename in os.listdir(BIN_DIR)
+                  if filename.startswith('thot_') and filename.endswith('.py'))
+
+
+def measure(command, repeat):
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = default_timer()
+            subprocess.check_call(command, stdout=devnull)
+            times.append(default_timer() - start)
+    times.sort()
+    return times[0], times[len(times) // 2]
+
+
+def main():
+    cli_args = argparser.parse_args()
+    print "%-28s %10s %12s" % ('script', 'best (ms)', 'median (ms)')
+    commands = [('(bare interpreter)', [sys.executable, '-c', 'pass'])]
+    for script in cli_args.scripts or get_scripts():
+        commands.append((script, [sys.executable, '-m', 'thot_utils.bin.%s' % script, '--help']))
+    for name, command in commands:
+        best, median = measure(command, cli_args.repeat)
+        print "%-28s %10.1f %12.1f" % (name, best * 1000, median * 1000)
+
+
+if __name__ == "__main__":
+    main()
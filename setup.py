@@ -38,10 +38,14 @@ metadata = dict(
         'console_scripts': [
             'thot_categorize = thot_utils.bin.thot_categorize:main',
             'thot_decategorize = thot_utils.bin.thot_decategorize:main',
+            'thot_detokenize = thot_utils.bin.thot_detokenize:main',
+            'thot_detokenize_precalculate = thot_utils.bin.thot_detokenize_precalculate:main',
             'thot_clean_corpus_ln = thot_utils.bin.thot_clean_corpus_ln:main',
             'thot_lowercase = thot_utils.bin.thot_lowercase:main',
+            'thot_preprocess = thot_utils.bin.thot_preprocess:main',
             'thot_recase = thot_utils.bin.thot_recase:main',
             'thot_recase_precalculate = thot_utils.bin.thot_recase_precalculate:main',
+            'thot_recase_server = thot_utils.bin.thot_recase_server:main',
             'thot_tokenize = thot_utils.bin.thot_tokenize:main',
         ],
     },
@@ -10,6 +10,7 @@ import io
 import sys
 
 from thot_utils.libs.file_input import FileInput
+from thot_utils.libs.parallel import imap_chunks_ordered
 from thot_utils.libs import thot_preproc
 
 argparser = argparse.ArgumentParser(description=__doc__)
@@ -28,6 +29,18 @@ mutex_group.add_argument(
     help='Read model from standard input',
 )
 
+argparser.add_argument(
+    '-w',
+    '--workers',
+    type=int,
+    help='Number of processes categorizing lines in parallel, on chunks of lines (1 by default)',
+    default=1,
+)
+
+
+def categorize_line(line):
+    return thot_preproc.categorize(line).encode('utf-8')
+
 
 def main():
     cli_args = argparser.parse_args()
@@ -37,6 +50,5 @@ def main():
         fd = io.open(cli_args.file, 'r', encoding='utf-8')
 
     with FileInput(fd) as f:
-        for line in f:
-            categorized_line = thot_preproc.categorize(line)
-            print categorized_line.encode('utf-8')
+        for categorized_line in imap_chunks_ordered(categorize_line, f, workers=cli_args.workers):
+            print categorized_line
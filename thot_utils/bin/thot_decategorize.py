@@ -6,8 +6,10 @@ Some description
 import argparse
 import io
 import itertools
+import sys
 
 from thot_utils.libs import thot_preproc
+from thot_utils.libs.parallel import imap_chunks_ordered
 
 argparser = argparse.ArgumentParser(description=__doc__)
 argparser.add_argument(
@@ -28,12 +30,36 @@ argparser.add_argument(
 argparser.add_argument(
     '-i',
     '--hypothesis-file',
+    type=str,
+    help='File with hypothesis information (segmentation and alignment of the target text)',
+    required=True,
+)
+
+argparser.add_argument(
+    '-w',
+    '--workers',
     type=int,
-    help='Minimum sentence length (1 by default)',
+    help='Number of processes decategorizing lines in parallel (1 by default)',
     default=1,
 )
 
 
+def decategorize_lines(lines):
+    # Read source, target and hypothesis information
+    sline, tline, iline = [line.strip('\n') for line in lines]
+    return thot_preproc.decategorize(sline, tline, iline)
+
+
+def read_lines(files, names):
+    # The files are read in lockstep, a file that ends before the others is only found when it is reached
+    for lineno, lines in enumerate(itertools.izip_longest(*files), 1):
+        if None in lines:
+            ended = [name for name, line in zip(names, lines) if line is None]
+            argparser.error('source, target and hypothesis files have different number of lines (%s ended before '
+                            'line %d)' % (' and '.join(ended), lineno))
+        yield lines
+
+
 def main():
     cli_args = argparser.parse_args()
 
@@ -41,14 +67,10 @@ def main():
     tfile = io.open(cli_args.target_file, 'r', encoding='utf-8')
     ifile = io.open(cli_args.hypothesis_file, 'r', encoding='utf-8')
 
-    for sline, tline, iline in itertools.izip(sfile, tfile, ifile):
-        # Read source, target and hypothesis information
-        sline = sline.strip('\n')
-        tline = tline.strip('\n')
-        iline = iline.strip('\n')
-
-        decategorized_line = thot_preproc.decategorize(sline, tline, iline)
-        print decategorized_line.encode('utf-8')
+    lines = read_lines([sfile, tfile, ifile], ['source file', 'target file', 'hypothesis file'])
+    for decategorized_line in imap_chunks_ordered(decategorize_lines, lines, workers=cli_args.workers):
+        sys.stdout.write(decategorized_line.encode('utf-8'))
+        sys.stdout.write(b'\n')
 
 
 if __name__ == '__main__':
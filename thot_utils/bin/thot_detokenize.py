@@ -0,0 +1,188 @@
+# -*- coding:utf-8 -*-
+"""
+Detokenizes text with the model stored by thot_detokenize_precalculate. Lines are written as soon as they are
+detokenized, so the tool can be used as a filter on a pipe.
+"""
+import argparse
+import io
+import sys
+
+from thot_utils.libs.detokenization_models import create_detok_decoder
+from thot_utils.libs.detokenization_models import get_detok_model_filenames
+from thot_utils.libs.detokenization_models import load_detok_providers
+from thot_utils.libs.parallel import imap_streaming
+from thot_utils.libs.result_cache import ResultCache
+from thot_utils.libs.result_cache import get_model_key
+
+argparser = argparse.ArgumentParser(description=__doc__)
+
+argparser.add_argument(
+    '-r',
+    '--raw',
+    type=str,
+    help='File with raw text the detokenization model was precalculated from',
+    required=True,
+)
+
+mutex_group = argparser.add_mutually_exclusive_group(required=True)
+mutex_group.add_argument(
+    '-f',
+    '--file',
+    type=str,
+    help='File with tokenized text to be detokenized (can be read from stdin)',
+)
+
+mutex_group.add_argument(
+    '-s',
+    '--stdin',
+    action='store_true',
+    help='Read tokenized text from standard input',
+)
+
+argparser.add_argument(
+    '-n',
+    '--ngrams-length',
+    type=int,
+    help='Order of the language model (2 by default)',
+    default=2,
+)
+
+argparser.add_argument(
+    '--compact',
+    action='store_true',
+    help='Load the models from the compact files stored by thot_detokenize_precalculate --compact',
+)
+
+argparser.add_argument(
+    '--interp-prob',
+    type=float,
+    help='Language model interpolation weight (0.5 by default)',
+    default=None,
+)
+
+argparser.add_argument(
+    '-w',
+    '--workers',
+    type=int,
+    help='Number of processes detokenizing lines in parallel (1 by default)',
+    default=1,
+)
+
+argparser.add_argument(
+    '--cache-size',
+    type=int,
+    help='Keep the results of up to this number of distinct lines, so that repeated lines are not detokenized again '
+         '(0 by default, no cache). Only available with a single worker',
+    default=0,
+)
+
+argparser.add_argument(
+    '--cache-file',
+    type=str,
+    help='File where the result cache is kept between runs',
+    default=None,
+)
+
+argparser.add_argument(
+    '--windows',
+    action='store_true',
+    help='Split lines at tokens that are never joined and search the windows separately, which keeps the search of '
+         'long lines fast',
+)
+
+argparser.add_argument(
+    '--future-cost',
+    choices=['admissible', 'weighted'],
+    help='Add an estimate of the score of the tokens still to be detokenized to the hypotheses of the search (A* '
+         'search). The admissible estimate keeps the results, the weighted one expands fewer hypotheses',
+    default=None,
+)
+
+argparser.add_argument(
+    '--future-cost-weight',
+    type=float,
+    help='Weight the weighted future cost estimate is scaled by (1.05 by default)',
+    default=1.05,
+)
+
+argparser.add_argument(
+    '--max-options',
+    type=int,
+    help='Only consider the K most probable options of every token sequence',
+    default=None,
+)
+
+argparser.add_argument(
+    '--option-threshold',
+    type=float,
+    help='Only consider the options of every token sequence with at least this fraction of the probability of the best '
+         'one',
+    default=None,
+)
+
+argparser.add_argument(
+    '--max-queue-size',
+    type=int,
+    help='Maximum number of hypotheses in the queue of the search of a line, the worst ones are dropped when it is '
+         'full (no limit by default)',
+    default=None,
+)
+
+# Every worker process creates its own decoder the first time it is used, connections to the models can not be
+# inherited from the parent process
+_cli_args = None
+_cache = None
+_decoder = None
+
+
+def get_decoder():
+    global _decoder
+    if _decoder is None:
+        translation_model_provider, language_model_provider = load_detok_providers(_cli_args.raw, _cli_args.compact)
+        _decoder = create_detok_decoder(translation_model_provider, language_model_provider, _cli_args.ngrams_length,
+                                        _cli_args.interp_prob, _cache, _cli_args.windows, None, _cli_args.future_cost,
+                                        _cli_args.future_cost_weight, _cli_args.max_options,
+                                        _cli_args.option_threshold, _cli_args.max_queue_size)
+    return _decoder
+
+
+def detokenize_line(line):
+    line = line.decode('utf-8').strip('\n')
+    detok_line = get_decoder().detokenize_line(line, False)
+    if detok_line is None:
+        detok_line = line
+    return detok_line.encode('utf-8')
+
+
+def main():
+    global _cli_args, _cache
+    _cli_args = argparser.parse_args()
+    if _cli_args.cache_size > 0:
+        if _cli_args.workers > 1:
+            argparser.error('--cache-size can not be used with more than one worker')
+        model_key = get_model_key(get_detok_model_filenames(_cli_args.raw, _cli_args.compact),
+                                  _cli_args.ngrams_length, _cli_args.interp_prob, _cli_args.windows,
+                                  _cli_args.future_cost, _cli_args.future_cost_weight, _cli_args.max_options,
+                                  _cli_args.option_threshold, _cli_args.max_queue_size)
+        _cache = ResultCache(_cli_args.cache_size, model_key, _cli_args.cache_file)
+
+    if _cli_args.stdin:
+        fd = sys.stdin
+    else:
+        fd = io.open(_cli_args.file, 'rb')
+
+    # readline avoids the read-ahead buffer of file iteration, which would hold back lines read from a pipe
+    lines = iter(fd.readline, b'')
+    for detok_line in imap_streaming(detokenize_line, lines, workers=_cli_args.workers):
+        sys.stdout.write(detok_line)
+        sys.stdout.write(b'\n')
+        if _cli_args.stdin:
+            sys.stdout.flush()
+
+    if _cache is not None:
+        _cache.save()
+        _cache.report()
+
+
+if __name__ == "__main__":
+    main()
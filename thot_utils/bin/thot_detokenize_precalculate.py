@@ -0,0 +1,112 @@
+# -*- coding:utf-8 -*-
+"""
+Learns from raw text how tokens are joined into words and stores the detokenization model used by thot_detokenize
+in <raw>.detok.sqlite
+"""
+import argparse
+import io
+
+from thot_utils.libs import thot_preproc
+from thot_utils.libs.bloom_filter import store_bloom_filter
+from thot_utils.libs.detokenization_models import get_detok_compact_lm_filename
+from thot_utils.libs.detokenization_models import get_detok_compact_tm_filename
+from thot_utils.libs.detokenization_models import get_detok_db_filename
+from thot_utils.libs.detokenization_models import get_detok_lm_filter_filename
+from thot_utils.libs.detokenization_models import get_detok_lm_line
+from thot_utils.libs.detokenization_models import get_detok_tm_filter_filename
+from thot_utils.libs.language_model_file_provider import LanguageModelCompactProvider
+from thot_utils.libs.language_model_file_provider import LanguageModelDBProvider
+from thot_utils.libs.language_model_file_provider import LanguageModelFileProvider
+from thot_utils.libs.translation_model_file_provider import DetokenizationModelFileProvider
+from thot_utils.libs.translation_model_file_provider import TranslationModelCompactProvider
+from thot_utils.libs.translation_model_file_provider import TranslationModelDBPrivider
+
+argparser = argparse.ArgumentParser(description=__doc__)
+
+argparser.add_argument(
+    '-r',
+    '--raw',
+    type=str,
+    help='File with raw (untokenized) text in the language of interest.',
+    required=True,
+)
+
+argparser.add_argument(
+    '-n',
+    '--ngrams-length',
+    type=int,
+    help='Order of the n-grams counted for the language model (2 by default)',
+    default=2,
+)
+
+argparser.add_argument(
+    '--compact',
+    action='store_true',
+    help='Also store the models in compact read-only files (<raw>.detok.tm.compact and <raw>.detok.lm.compact)',
+)
+
+argparser.add_argument(
+    '--bloom-filter',
+    type=float,
+    metavar='RATE',
+    help='Also store Bloom filters of the keys of the models (<raw>.detok.tm.bloom and <raw>.detok.lm.bloom) with '
+         'the given false positive rate (e.g. 0.01), so that lookups of missing keys do not query the database. '
+         'Filters already stored are rebuilt with their own rate when the model is stored again',
+    default=None,
+)
+
+argparser.add_argument(
+    '--logprobs',
+    action='store_true',
+    help='Also store precomputed smoothed log-probabilities, so that decoding does not need to query raw counts',
+)
+
+argparser.add_argument(
+    '--interp-prob',
+    type=float,
+    help='Language model interpolation weight the log-probabilities are computed with (0.5 by default)',
+    default=None,
+)
+
+
+def main():
+    cli_args = argparser.parse_args()
+    if cli_args.bloom_filter is not None and not 0 < cli_args.bloom_filter < 1:
+        argparser.error('--bloom-filter must be a false positive rate between 0 and 1')
+
+    fd = io.open(cli_args.raw, 'r', encoding='utf-8')
+    translation_model_provider = DetokenizationModelFileProvider(fd)
+    db_translation_model_provider = TranslationModelDBPrivider(get_detok_db_filename(cli_args.raw))
+    db_translation_model_provider.load_from_other_provider(translation_model_provider)
+    store_bloom_filter(get_detok_tm_filter_filename(cli_args.raw), db_translation_model_provider.get_filter_keys(),
+                       cli_args.bloom_filter)
+
+    if cli_args.compact:
+        compact_translation_model_provider = TranslationModelCompactProvider()
+        compact_translation_model_provider.load_from_other_provider(translation_model_provider)
+        compact_translation_model_provider.save(get_detok_compact_tm_filename(cli_args.raw))
+
+    fd = io.open(cli_args.raw, 'r', encoding='utf-8')
+    language_model_provider = LanguageModelFileProvider((get_detok_lm_line(line) for line in fd),
+                                                        ngrams_length=cli_args.ngrams_length)
+    db_language_model_provider = LanguageModelDBProvider(get_detok_db_filename(cli_args.raw))
+    db_language_model_provider.load_from_other_provider(language_model_provider)
+    store_bloom_filter(get_detok_lm_filter_filename(cli_args.raw), db_language_model_provider.get_filter_keys(),
+                       cli_args.bloom_filter)
+
+    if cli_args.compact:
+        compact_language_model_provider = LanguageModelCompactProvider()
+        compact_language_model_provider.load_from_other_provider(language_model_provider)
+        compact_language_model_provider.save(get_detok_compact_lm_filename(cli_args.raw))
+
+    if cli_args.logprobs:
+        tmodel = thot_preproc.TransModel(model_provider=translation_model_provider)
+        db_translation_model_provider.load_logprobs(tmodel)
+
+        lmodel = thot_preproc.LangModel(language_model_provider, ngrams_length=cli_args.ngrams_length,
+                                        interp_prob=cli_args.interp_prob)
+        db_language_model_provider.load_logprobs(lmodel)
+
+
+if __name__ == "__main__":
+    main()
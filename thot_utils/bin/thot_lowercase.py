@@ -4,12 +4,13 @@
 Some description
 """
 import argparse
-import codecs
 import io
 import sys
 
 from thot_utils.libs import thot_preproc
 from thot_utils.libs.file_input import FileInput
+from thot_utils.libs.file_input import iter_plain_ascii_lines
+from thot_utils.libs.parallel import imap_chunks_ordered
 
 argparser = argparse.ArgumentParser(description=__doc__)
 mutex_group = argparser.add_mutually_exclusive_group(required=True)
@@ -27,19 +28,34 @@ mutex_group.add_argument(
     help='Read model from standard input',
 )
 
+argparser.add_argument(
+    '-w',
+    '--workers',
+    type=int,
+    help='Number of processes lowercasing lines in parallel, on chunks of lines (1 by default)',
+    default=1,
+)
+
+
+def lowercase_line(line):
+    if isinstance(line, bytes):
+        return thot_preproc.lowercase_ascii(line.strip(b"\n"))
+    line = line.strip("\n")
+    return thot_preproc.lowercase(line).encode("utf-8")
+
 
 def main():
     cli_args = argparser.parse_args()
     if cli_args.stdin:
-        fd = codecs.getreader('utf-8')(sys.stdin)
+        fd = sys.stdin
     else:
-        fd = io.open(cli_args.file, 'r', encoding='utf-8')
+        fd = io.open(cli_args.file, 'rb')
 
+    # Plain ASCII lines are read and processed as byte strings, other lines are decoded as before
     with FileInput(fd) as f:
-        for line in f:
-            line = line.strip("\n")
-            line = thot_preproc.lowercase(line)
-            print line.encode("utf-8")
+        lines = iter_plain_ascii_lines(f, universal_newlines=not cli_args.stdin)
+        for line in imap_chunks_ordered(lowercase_line, lines, workers=cli_args.workers):
+            print line
 
 
 if __name__ == "__main__":
@@ -0,0 +1,104 @@
+# -*- coding:utf-8 -*-
+"""
+Runs a chain of preprocessing steps in a single process, without serializing the text between them
+"""
+import argparse
+import codecs
+import io
+import sys
+
+from thot_utils.libs import pipeline
+from thot_utils.libs.file_input import FileInput
+
+STEPS = ('tokenize', 'lowercase', 'categorize', 'recase')
+
+argparser = argparse.ArgumentParser(description=__doc__)
+
+argparser.add_argument(
+    '-p',
+    '--steps',
+    type=str,
+    help='Comma separated list of steps to run in order, chosen from: %s' % ', '.join(STEPS),
+    required=True,
+)
+
+argparser.add_argument(
+    '-r',
+    '--raw',
+    type=str,
+    help='File with raw text in the language of interest, the recasing model is read from <raw>.sqlite',
+)
+
+argparser.add_argument(
+    '-n',
+    '--ngrams-length',
+    type=int,
+    help='Order of the language model (2 by default)',
+    default=2,
+)
+
+mutex_group = argparser.add_mutually_exclusive_group(required=True)
+mutex_group.add_argument(
+    '-f',
+    '--file',
+    type=str,
+    help='File with text to be processed (can be read from stdin)',
+)
+
+mutex_group.add_argument(
+    '-s',
+    '--stdin',
+    action='store_true',
+    help='Read model from standard input',
+)
+
+argparser.add_argument(
+    '-q',
+    '--queue-size',
+    type=int,
+    help='Run every step in its own thread, passing lines through queues of this size (0 by default: the steps are '
+         'chained generators)',
+    default=0,
+)
+
+
+def create_stage(step, cli_args):
+    if step == 'tokenize':
+        return pipeline.tokenize_stage
+    elif step == 'lowercase':
+        return pipeline.lowercase_stage
+    elif step == 'categorize':
+        return pipeline.categorize_stage
+    else:
+        # The models are only loaded by the recase step
+        from thot_utils.libs.recase_models import create_recase_decoder
+        from thot_utils.libs.recase_models import load_recase_providers
+        translation_model_provider, language_model_provider = load_recase_providers(cli_args.raw)
+        decoder = create_recase_decoder(translation_model_provider, language_model_provider, cli_args.ngrams_length)
+        return pipeline.create_recase_stage(decoder)
+
+
+def main():
+    cli_args = argparser.parse_args()
+    steps = cli_args.steps.split(',')
+    for step in steps:
+        if step not in STEPS:
+            argparser.error('unknown step %s' % step)
+    if 'recase' in steps and not cli_args.raw:
+        argparser.error('the recase step requires --raw')
+
+    stages = [create_stage(step, cli_args) for step in steps]
+
+    if cli_args.stdin:
+        fd = codecs.getreader('utf-8')(sys.stdin)
+    else:
+        fd = io.open(cli_args.file, 'r', encoding='utf-8')
+
+    with FileInput(fd) as f:
+        lines = (line.strip("\n") for line in f)
+        for line in pipeline.Pipeline(stages, queue_size=cli_args.queue_size).run(lines):
+            print line.encode("utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,10 +8,14 @@ import codecs
 import sys
 
 import io
-from thot_utils.libs import thot_preproc
 from thot_utils.libs.file_input import FileInput
-from thot_utils.libs.language_model_file_provider import LanguageModelDBProvider
-from thot_utils.libs.translation_model_file_provider import TranslationModelDBPrivider
+from thot_utils.libs.provider_tracing import TracingLanguageModelProvider
+from thot_utils.libs.provider_tracing import TracingTranslationModelProvider
+from thot_utils.libs.recase_models import create_recase_decoder
+from thot_utils.libs.recase_models import get_recase_model_filenames
+from thot_utils.libs.recase_models import load_recase_providers
+from thot_utils.libs.result_cache import ResultCache
+from thot_utils.libs.result_cache import get_model_key
 
 argparser = argparse.ArgumentParser(description=__doc__)
 
@@ -38,20 +42,147 @@ mutex_group.add_argument(
     help='Read model from standard input',
 )
 
+argparser.add_argument(
+    '-n',
+    '--ngrams-length',
+    type=int,
+    help='Order of the language model (2 by default)',
+    default=2,
+)
+
+argparser.add_argument(
+    '--compact',
+    action='store_true',
+    help='Load the models from the compact files stored by thot_recase_precalculate --compact',
+)
+
+argparser.add_argument(
+    '--interp-prob',
+    type=float,
+    help='Language model interpolation weight (0.5 by default). Precomputed log-probabilities are only used if they '
+         'were stored with the same weight',
+    default=None,
+)
+
+argparser.add_argument(
+    '--trace',
+    action='store_true',
+    help='Trace the calls made to the model providers and print a report to stderr when finished',
+)
+
+argparser.add_argument(
+    '--trace-keys',
+    type=int,
+    help='Number of most queried keys shown in the trace report (10 by default)',
+    default=10,
+)
+
+argparser.add_argument(
+    '--cache-size',
+    type=int,
+    help='Keep the results of up to this number of distinct lines, so that repeated lines are not recased again '
+         '(0 by default, no cache)',
+    default=0,
+)
+
+argparser.add_argument(
+    '--cache-file',
+    type=str,
+    help='File where the result cache is kept between runs',
+    default=None,
+)
+
+argparser.add_argument(
+    '--windows',
+    action='store_true',
+    help='Split lines at unambiguous words and search the windows separately, which keeps the search of long lines '
+         'fast',
+)
+
+argparser.add_argument(
+    '--window-threads',
+    type=int,
+    help='Number of threads searching the windows of a line in parallel (1 by default)',
+    default=1,
+)
+
+argparser.add_argument(
+    '--future-cost',
+    choices=['admissible', 'weighted'],
+    help='Add an estimate of the score of the words still to be recased to the hypotheses of the search (A* search). '
+         'The admissible estimate keeps the results, the weighted one expands fewer hypotheses',
+    default=None,
+)
+
+argparser.add_argument(
+    '--future-cost-weight',
+    type=float,
+    help='Weight the weighted future cost estimate is scaled by (1.05 by default)',
+    default=1.05,
+)
+
+argparser.add_argument(
+    '--max-options',
+    type=int,
+    help='Only consider the K most probable options of every word or phrase',
+    default=None,
+)
+
+argparser.add_argument(
+    '--option-threshold',
+    type=float,
+    help='Only consider the options of every word or phrase with at least this fraction of the probability of the best '
+         'one',
+    default=None,
+)
+
+argparser.add_argument(
+    '--max-queue-size',
+    type=int,
+    help='Maximum number of hypotheses in the queue of the search of a line, the worst ones are dropped when it is '
+         'full (no limit by default)',
+    default=None,
+)
+
+argparser.add_argument(
+    '--nbest',
+    type=int,
+    help='Write the K best recased sentences of every line with their scores, as "line number ||| sentence ||| score" '
+         '(line numbers start at 0)',
+    default=None,
+)
+
 
 def main():
     cli_args = argparser.parse_args()
+    if cli_args.nbest is not None:
+        if cli_args.nbest < 1:
+            argparser.error('--nbest must be at least 1')
+        if cli_args.windows or cli_args.cache_size > 0:
+            argparser.error('--nbest can not be used with --windows or --cache-size')
 
-    db_translation_model_provider = TranslationModelDBPrivider('%s.sqlite' % cli_args.raw)
+    translation_model_provider, language_model_provider = load_recase_providers(cli_args.raw, cli_args.compact)
+    if cli_args.trace:
+        translation_model_provider = TracingTranslationModelProvider(translation_model_provider)
+        language_model_provider = TracingLanguageModelProvider(language_model_provider)
 
-    tmodel = thot_preproc.TransModel(
-        model_provider=db_translation_model_provider
-    )
-    db_language_model_provider = LanguageModelDBProvider('%s.sqlite' % cli_args.raw)
-    lmodel = thot_preproc.LangModel(db_language_model_provider, ngrams_length=2)
+    cache = None
+    if cli_args.cache_size > 0:
+        model_key = get_model_key(get_recase_model_filenames(cli_args.raw, cli_args.compact), cli_args.ngrams_length,
+                                  cli_args.interp_prob, cli_args.windows, cli_args.future_cost,
+                                  cli_args.future_cost_weight, cli_args.max_options, cli_args.option_threshold,
+                                  cli_args.max_queue_size)
+        cache = ResultCache(cli_args.cache_size, model_key, cli_args.cache_file)
 
-    weights = [0, 0, 0, 1]
-    decoder = thot_preproc.Decoder(tmodel, lmodel, weights)
+    window_pool = None
+    if cli_args.windows and cli_args.window_threads > 1:
+        from multiprocessing.pool import ThreadPool
+        window_pool = ThreadPool(cli_args.window_threads)
+
+    decoder = create_recase_decoder(translation_model_provider, language_model_provider, cli_args.ngrams_length,
+                                    cli_args.interp_prob, cache, cli_args.windows, window_pool, cli_args.future_cost,
+                                    cli_args.future_cost_weight, cli_args.max_options, cli_args.option_threshold,
+                                    cli_args.max_queue_size)
 
     print >> sys.stderr, "Recasing..."
     if cli_args.stdin:
@@ -60,8 +191,26 @@ def main():
         fd = io.open(cli_args.file, 'r', encoding='utf-8')
 
     with FileInput(fd) as f:
-        for line in f:
-            decoder.recase([line], False)
+        if cli_args.nbest is None:
+            for line in f:
+                decoder.recase([line], False)
+        else:
+            for lineno, line in enumerate(f):
+                line = line.strip("\n")
+                nblist = decoder.recase_nbest_line(line, cli_args.nbest, False)
+                if len(nblist) == 0:
+                    print >> sys.stderr, "Warning: no recased sentences were found for sentence in line", lineno + 1
+                    nblist = [(line, 0)]
+                for words, score in nblist:
+                    print ("%d ||| %s ||| %s" % (lineno, words, repr(score))).encode("utf-8")
+
+    if cli_args.trace:
+        translation_model_provider.report(cli_args.trace_keys)
+        language_model_provider.report(cli_args.trace_keys)
+
+    if cache is not None:
+        cache.save()
+        cache.report()
 
 
 if __name__ == "__main__":
@@ -5,8 +5,28 @@ Some description
 """
 import argparse
 import io
+import os
+import sys
+from timeit import default_timer
 
+from thot_utils.libs import thot_preproc
+from thot_utils.libs.bloom_filter import store_bloom_filter
+from thot_utils.libs.language_model_file_provider import LanguageModelCompactProvider
 from thot_utils.libs.language_model_file_provider import LanguageModelDBProvider, LanguageModelFileProvider
+from thot_utils.libs.provider_tracing import TracingLanguageModelProvider
+from thot_utils.libs.provider_tracing import TracingTranslationModelProvider
+from thot_utils.libs.recase_models import create_recase_decoder
+from thot_utils.libs.recase_models import evaluate_recasing
+from thot_utils.libs.recase_models import get_compact_lm_filename
+from thot_utils.libs.recase_models import get_compact_tm_filename
+from thot_utils.libs.recase_models import get_db_filename
+from thot_utils.libs.recase_models import get_lm_filter_filename
+from thot_utils.libs.recase_models import get_recase_model_filenames
+from thot_utils.libs.recase_models import get_tm_filter_filename
+from thot_utils.libs.recase_models import load_recase_providers
+from thot_utils.libs.translation_model_file_provider import TranslationModelCompactProvider
+from thot_utils.libs.translation_model_file_provider import TranslationModelDBPrivider
+from thot_utils.libs.translation_model_file_provider import TranslationModelFileProvider
 
 argparser = argparse.ArgumentParser(description=__doc__)
 
@@ -18,19 +38,188 @@ argparser.add_argument(
     required=True,
 )
 
+argparser.add_argument(
+    '-u',
+    '--update',
+    type=str,
+    help='File with new raw text whose counts are added to the existing model of --raw instead of rebuilding it. '
+         'Log-probabilities and compact files are only recomputed if requested',
+    default=None,
+)
+
+argparser.add_argument(
+    '-n',
+    '--ngrams-length',
+    type=int,
+    help='Order of the n-grams counted for the language model (2 by default, the order of the stored model with '
+         '--update)',
+    default=None,
+)
+
+argparser.add_argument(
+    '--compact',
+    action='store_true',
+    help='Also store the models in compact read-only files (<raw>.tm.compact and <raw>.lm.compact)',
+)
+
+argparser.add_argument(
+    '--quantize',
+    action='store_true',
+    help='Store the counts of the compact language model as 8 bit codes (approximate counts, smaller file)',
+)
+
+argparser.add_argument(
+    '--bloom-filter',
+    type=float,
+    metavar='RATE',
+    help='Also store Bloom filters of the keys of the models (<raw>.tm.bloom and <raw>.lm.bloom) with the given '
+         'false positive rate (e.g. 0.01), so that lookups of missing keys do not query the database. Filters already '
+         'stored are rebuilt with their own rate when the model is stored again',
+    default=None,
+)
+
+argparser.add_argument(
+    '--logprobs',
+    action='store_true',
+    help='Also store precomputed smoothed log-probabilities, so that decoding does not need to query raw counts',
+)
+
+argparser.add_argument(
+    '--interp-prob',
+    type=float,
+    help='Language model interpolation weight the log-probabilities are computed with (0.5 by default)',
+    default=None,
+)
+
+argparser.add_argument(
+    '--min-counts',
+    type=str,
+    help='Comma separated minimum count of the n-grams kept for each order, starting with unigrams. The last value '
+         'applies to the higher orders (e.g. 1,2 keeps all unigrams and the rest of n-grams seen twice)',
+    default=None,
+)
+
+argparser.add_argument(
+    '--max-targets',
+    type=int,
+    help='Maximum number of casings kept for every word, the most frequent ones',
+    default=None,
+)
+
+argparser.add_argument(
+    '--vocab-size',
+    type=int,
+    help='Only keep the n-grams of the language model made of the given number of most frequent words',
+    default=None,
+)
+
+argparser.add_argument(
+    '--heldout',
+    type=str,
+    help='File with raw text not used for training. The stored model recases its lowercased version and the '
+         'accuracy, the model size and the lookup times are reported',
+    default=None,
+)
+
+
+def parse_min_counts(value):
+    try:
+        min_counts = [int(count) for count in value.split(',')]
+    except ValueError:
+        argparser.error('--min-counts must be a comma separated list of integers')
+    return min_counts
+
+
+def get_ngrams_length(cli_args):
+    # Updates count the n-grams of the order of the stored model, any other order would leave it inconsistent
+    stored_ngrams_length = None
+    if cli_args.update:
+        stored_ngrams_length = LanguageModelDBProvider(get_db_filename(cli_args.raw)).get_ngrams_length()
+    if stored_ngrams_length is None:
+        return cli_args.ngrams_length or 2
+    if cli_args.ngrams_length and cli_args.ngrams_length != stored_ngrams_length:
+        argparser.error('the model of --raw has n-grams of length %d, it can not be updated with n-grams of length %d'
+                        % (stored_ngrams_length, cli_args.ngrams_length))
+    return stored_ngrams_length
+
+
+def report_heldout(cli_args):
+    translation_model_provider, language_model_provider = load_recase_providers(cli_args.raw, cli_args.compact)
+    translation_model_provider = TracingTranslationModelProvider(translation_model_provider)
+    language_model_provider = TracingLanguageModelProvider(language_model_provider)
+    decoder = create_recase_decoder(translation_model_provider, language_model_provider, cli_args.ngrams_length,
+                                    cli_args.interp_prob)
+
+    with io.open(cli_args.heldout, 'r', encoding='utf-8') as f:
+        start = default_timer()
+        correct, total = evaluate_recasing(decoder, (line.strip("\n") for line in f))
+        elapsed = default_timer() - start
+
+    for filename in get_recase_model_filenames(cli_args.raw, cli_args.compact):
+        print >> sys.stderr, "Model file %s: %d bytes" % (filename, os.path.getsize(filename))
+    print >> sys.stderr, "Held-out recasing accuracy: %.2f%% (%d of %d words) in %.3f s" % (
+        100.0 * correct / total if total else 0, correct, total, elapsed)
+    translation_model_provider.report(top_keys=0)
+    language_model_provider.report(top_keys=0)
+
 
 def main():
     cli_args = argparser.parse_args()
+    text_filename = cli_args.update or cli_args.raw
+    min_counts = parse_min_counts(cli_args.min_counts) if cli_args.min_counts else None
+    if cli_args.update and (min_counts or cli_args.max_targets or cli_args.vocab_size):
+        argparser.error('pruning options can not be used with --update, the model has to be rebuilt')
+    if cli_args.bloom_filter is not None and not 0 < cli_args.bloom_filter < 1:
+        argparser.error('--bloom-filter must be a false positive rate between 0 and 1')
+    cli_args.ngrams_length = get_ngrams_length(cli_args)
+
+    fd = io.open(text_filename, 'r', encoding='utf-8')
+    translation_model_provider = TranslationModelFileProvider(fd)
+    if cli_args.max_targets:
+        translation_model_provider.prune(cli_args.max_targets)
+    db_translation_model_provider = TranslationModelDBPrivider(get_db_filename(cli_args.raw))
+    if cli_args.update:
+        db_translation_model_provider.update_from_other_provider(translation_model_provider)
+        # Derived models need the accumulated counts
+        translation_model_provider = db_translation_model_provider
+    else:
+        db_translation_model_provider.load_from_other_provider(translation_model_provider)
+    store_bloom_filter(get_tm_filter_filename(cli_args.raw), db_translation_model_provider.get_filter_keys(),
+                       cli_args.bloom_filter)
+
+    if cli_args.compact:
+        compact_translation_model_provider = TranslationModelCompactProvider()
+        compact_translation_model_provider.load_from_other_provider(translation_model_provider)
+        compact_translation_model_provider.save(get_compact_tm_filename(cli_args.raw))
+
+    fd = io.open(text_filename, 'r', encoding='utf-8')
+    language_model_provider = LanguageModelFileProvider(fd, ngrams_length=cli_args.ngrams_length)
+    if min_counts or cli_args.vocab_size:
+        language_model_provider.prune(min_counts, cli_args.vocab_size)
+    db_language_model_provider = LanguageModelDBProvider(get_db_filename(cli_args.raw))
+    if cli_args.update:
+        db_language_model_provider.update_from_other_provider(language_model_provider)
+        language_model_provider = db_language_model_provider
+    else:
+        db_language_model_provider.load_from_other_provider(language_model_provider)
+    store_bloom_filter(get_lm_filter_filename(cli_args.raw), db_language_model_provider.get_filter_keys(),
+                       cli_args.bloom_filter)
+
+    if cli_args.compact:
+        compact_language_model_provider = LanguageModelCompactProvider(quantize=cli_args.quantize)
+        compact_language_model_provider.load_from_other_provider(language_model_provider)
+        compact_language_model_provider.save(get_compact_lm_filename(cli_args.raw))
+
+    if cli_args.logprobs:
+        tmodel = thot_preproc.TransModel(model_provider=translation_model_provider)
+        db_translation_model_provider.load_logprobs(tmodel)
 
-    # fd = io.open(cli_args.raw, 'r', encoding='utf-8')
-    # translation_model_provider = TranslationModelFileProvider(fd)
-    # db_translation_model_provider = TranslationModelDBPrivider('%s.sqlite' % cli_args.raw)
-    # db_translation_model_provider.load_from_other_provider(translation_model_provider)
+        lmodel = thot_preproc.LangModel(language_model_provider, ngrams_length=cli_args.ngrams_length,
+                                        interp_prob=cli_args.interp_prob)
+        db_language_model_provider.load_logprobs(lmodel)
 
-    fd = io.open(cli_args.raw, 'r', encoding='utf-8')
-    language_model_provider = LanguageModelFileProvider(fd, ngrams_length=2)
-    db_language_model_provider = LanguageModelDBProvider('%s.sqlite' % cli_args.raw)
-    db_language_model_provider.load_from_other_provider(language_model_provider)
+    if cli_args.heldout:
+        report_heldout(cli_args)
 
 
 if __name__ == "__main__":
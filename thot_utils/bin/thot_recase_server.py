@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+"""
+Loads a recasing model once and recases the lines sent through a Unix socket or the standard input, one response line
+per request line
+"""
+import argparse
+import sys
+
+from thot_utils.libs.recase_models import create_recase_decoder
+from thot_utils.libs.recase_models import get_recase_model_filenames
+from thot_utils.libs.recase_models import load_recase_providers
+from thot_utils.libs.recase_service import RecaseService
+from thot_utils.libs.result_cache import ResultCache
+from thot_utils.libs.result_cache import get_model_key
+
+argparser = argparse.ArgumentParser(description=__doc__)
+
+argparser.add_argument(
+    '-r',
+    '--raw',
+    type=str,
+    help='File with raw text in the language of interest.',
+    required=True,
+)
+
+mutex_group = argparser.add_mutually_exclusive_group(required=True)
+mutex_group.add_argument(
+    '-u',
+    '--socket',
+    type=str,
+    help='Path of the Unix socket to listen on',
+)
+
+mutex_group.add_argument(
+    '-s',
+    '--stdio',
+    action='store_true',
+    help='Read requests from standard input and write responses to standard output',
+)
+
+argparser.add_argument(
+    '-c',
+    '--concurrency',
+    type=int,
+    help='Number of lines recased at the same time (1 by default)',
+    default=1,
+)
+
+argparser.add_argument(
+    '-n',
+    '--ngrams-length',
+    type=int,
+    help='Order of the language model (2 by default)',
+    default=2,
+)
+
+argparser.add_argument(
+    '--compact',
+    action='store_true',
+    help='Load the models from the compact files stored by thot_recase_precalculate --compact',
+)
+
+argparser.add_argument(
+    '--interp-prob',
+    type=float,
+    help='Language model interpolation weight (0.5 by default)',
+    default=None,
+)
+
+argparser.add_argument(
+    '--cache-size',
+    type=int,
+    help='Keep the results of up to this number of distinct lines, so that repeated lines are not recased again '
+         '(0 by default, no cache)',
+    default=0,
+)
+
+argparser.add_argument(
+    '--cache-file',
+    type=str,
+    help='File where the result cache is kept between runs',
+    default=None,
+)
+
+
+def main():
+    cli_args = argparser.parse_args()
+
+    translation_model_provider, language_model_provider = load_recase_providers(cli_args.raw, cli_args.compact)
+    cache = None
+    if cli_args.cache_size > 0:
+        model_key = get_model_key(get_recase_model_filenames(cli_args.raw, cli_args.compact), cli_args.ngrams_length,
+                                  cli_args.interp_prob)
+        cache = ResultCache(cli_args.cache_size, model_key, cli_args.cache_file)
+
+    decoder = create_recase_decoder(translation_model_provider, language_model_provider, cli_args.ngrams_length,
+                                    cli_args.interp_prob, cache)
+
+    service = RecaseService(decoder, concurrency=cli_args.concurrency)
+    print >> sys.stderr, "Ready"
+    try:
+        if cli_args.stdio:
+            service.serve(sys.stdin, sys.stdout)
+        else:
+            service.serve_unix_socket(cli_args.socket)
+    except KeyboardInterrupt:
+        pass
+
+    if cache is not None:
+        cache.save()
+        cache.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,13 @@
 
 # import modules
 import argparse
-import codecs
 import io
 import sys
 
 from thot_utils.libs import thot_preproc
 from thot_utils.libs.file_input import FileInput
+from thot_utils.libs.file_input import iter_plain_ascii_lines
+from thot_utils.libs.parallel import imap_chunks_ordered
 
 argparser = argparse.ArgumentParser(description=__doc__)
 
@@ -27,21 +28,36 @@ mutex_group.add_argument(
     help='Read model from standard input',
 )
 
+argparser.add_argument(
+    '-w',
+    '--workers',
+    type=int,
+    help='Number of processes tokenizing lines in parallel, on chunks of lines (1 by default)',
+    default=1,
+)
+
+
+def tokenize_line(line):
+    if isinstance(line, bytes):
+        return b' '.join(thot_preproc.tokenize_ascii(line.strip(b"\n")))
+    line = line.strip("\n")
+    tokens = thot_preproc.tokenize(line)
+    return u' '.join(tokens).encode("utf-8")
+
 
 ##################################################
 def main():
     cli_args = argparser.parse_args()
     if cli_args.stdin:
-        fd = codecs.getreader('utf-8')(sys.stdin)
+        fd = sys.stdin
     else:
-        fd = io.open(cli_args.file, 'r', encoding='utf-8')
+        fd = io.open(cli_args.file, 'rb')
 
+    # Plain ASCII lines are read and processed as byte strings, other lines are decoded as before
     with FileInput(fd) as f:
-        for line in f:
-            line = line.strip("\n")
-            tokens = thot_preproc.tokenize(line)
-            tok_sent = u' '.join(tokens)
-            print tok_sent.encode("utf-8")
+        lines = iter_plain_ascii_lines(f, universal_newlines=not cli_args.stdin)
+        for tok_sent in imap_chunks_ordered(tokenize_line, lines, workers=cli_args.workers):
+            print tok_sent
 
 
 if __name__ == "__main__":
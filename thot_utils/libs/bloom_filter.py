@@ -0,0 +1,155 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+import os
+import sys
+import threading
+from array import array
+
+from thot_utils.libs.compact_storage import CompactStorage
+
+# Lookups are checked on every query, so only a few positions of the filter are probed for every key. Reaching the
+# same false positive rate takes more bits than with the optimal number of positions (about 30% more for 1%)
+_max_hashes = 3
+
+# Keys are hashed with the built-in string hash, which differs between platforms and with hash randomization. The
+# hash of this string is stored with the filter, a filter built with a different hash is not used
+_hash_check_key = 'thot_utils bloom filter'
+
+
+class BloomFilter(CompactStorage):
+    """
+    Compact set of the keys stored in a model, consulted before querying the model: keys that were added are always
+    found, other keys are found with a probability close to the false positive rate the filter was built with, so
+    most lookups of missing keys can be skipped.
+    """
+
+    def __init__(self, num_keys, false_positive_rate=0.01):
+        self.false_positive_rate = false_positive_rate
+        num_keys = max(num_keys, 1)
+        self.num_hashes = max(1, min(_max_hashes, int(round(-math.log(false_positive_rate, 2)))))
+        self.num_bits = max(8, int(math.ceil(
+            -self.num_hashes * num_keys / math.log(1 - false_positive_rate ** (1 / self.num_hashes)))))
+        self.bits = array(str('B'), [0]) * ((self.num_bits + 7) // 8)
+        self.num_keys = 0
+        self.hash_check = hash(_hash_check_key)
+        self.reset_stats()
+
+    def reset_stats(self):
+        # Lookups checked, lookups skipped because the key was not found and keys found that were not in the model.
+        # Filters are shared by the decoders of several threads, so they are counted under a lock
+        self.stats_lock = threading.Lock()
+        self.num_checked = 0
+        self.num_rejected = 0
+        self.num_false_positives = 0
+
+    def __getstate__(self):
+        state = CompactStorage.__getstate__(self)
+        for key in ('stats_lock', 'num_checked', 'num_rejected', 'num_false_positives'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        CompactStorage.__setstate__(self, state)
+        self.reset_stats()
+
+    def has_same_hash(self):
+        return self.hash_check == hash(_hash_check_key)
+
+    def get_positions(self, key):
+        # Double hashing: the positions are spaced by a step taken from the high bits of the hash
+        key_hash = hash(key)
+        step = (key_hash >> 32) | 1
+        return [(key_hash + i * step) % self.num_bits for i in xrange(self.num_hashes)]
+
+    def add(self, key):
+        for pos in self.get_positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.num_keys += 1
+
+    def __contains__(self, key):
+        # Same positions as get_positions, computed one at a time, as most missing keys are rejected by the first one
+        key_hash = hash(key)
+        step = (key_hash >> 32) | 1
+        num_bits = self.num_bits
+        bits = self.bits
+        pos = key_hash % num_bits
+        for _ in xrange(self.num_hashes):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+            pos = (pos + step) % num_bits
+        return True
+
+    def may_contain(self, key):
+        """
+        Returns whether the key may be stored in the model and counts the lookup
+        """
+        found = key in self
+        with self.stats_lock:
+            self.num_checked += 1
+            if not found:
+                self.num_rejected += 1
+        return found
+
+    def record_false_positive(self):
+        """
+        Counts a key found by the filter that the model did not have
+        """
+        with self.stats_lock:
+            self.num_false_positives += 1
+
+    def get_expected_false_positive_rate(self):
+        return (1 - math.exp(-self.num_hashes * self.num_keys / self.num_bits)) ** self.num_hashes
+
+    def get_observed_false_positive_rate(self):
+        # Fraction of the missing keys the filter did not reject
+        num_missing = self.num_rejected + self.num_false_positives
+        if num_missing == 0:
+            return 0.0
+        return self.num_false_positives / num_missing
+
+    def report(self, name, fd=sys.stderr):
+        print('Bloom filter of %s: %d keys, %d bytes, %d lookups checked, %d skipped, %d false positives, '
+              'observed false positive rate %.4f (%.4f expected, %.4f requested)' % (
+                  name, self.num_keys, len(self.bits), self.num_checked, self.num_rejected,
+                  self.num_false_positives, self.get_observed_false_positive_rate(),
+                  self.get_expected_false_positive_rate(), self.false_positive_rate), file=fd)
+
+
+def create_bloom_filter(keys, false_positive_rate=0.01):
+    keys = list(keys)
+    bloom_filter = BloomFilter(len(keys), false_positive_rate)
+    for key in keys:
+        bloom_filter.add(key)
+    return bloom_filter
+
+
+def load_bloom_filter(filename):
+    """
+    Returns the Bloom filter stored in the file or None if there is none or it can not be used on this platform
+    """
+    if not os.path.exists(filename):
+        return None
+    bloom_filter = BloomFilter.load(filename)
+    if not bloom_filter.has_same_hash():
+        print('Warning: the Bloom filter %s was built with a different string hash and is not used' % filename,
+              file=sys.stderr)
+        return None
+    return bloom_filter
+
+
+def store_bloom_filter(filename, keys, false_positive_rate=None):
+    """
+    Stores the Bloom filter of the keys of a model that has just been stored or updated. Without a false positive
+    rate, the filter already stored next to the model is rebuilt with its own rate, so that it never misses the
+    keys added to the model, and no filter is stored if there was none.
+    """
+    if false_positive_rate is None:
+        if not os.path.exists(filename):
+            return
+        false_positive_rate = BloomFilter.load(filename).false_positive_rate
+    create_bloom_filter(keys, false_positive_rate).save(filename)
@@ -0,0 +1,128 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cPickle
+import math
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+
+class Vocabulary(object):
+    """
+    Sorted list of words where every word is identified by its position. Lookups are binary searches, so no index is
+    kept besides the list itself.
+    """
+
+    def __init__(self, words=()):
+        self.words = sorted(set(words))
+
+    def __len__(self):
+        return len(self.words)
+
+    def get_id(self, word):
+        """
+        Returns the id of the word or None if it is not in the vocabulary
+        """
+        idx = bisect_left(self.words, word)
+        if idx < len(self.words) and self.words[idx] == word:
+            return idx
+        return None
+
+    def get_word(self, word_id):
+        return self.words[word_id]
+
+
+class CompactStorage(object):
+    """
+    Mixin for read-only models kept in flat arrays. Arrays, also inside lists, are pickled as raw machine values and
+    the model can be saved to and loaded from a file.
+    """
+
+    def __getstate__(self):
+        return dict((key, self.pack(value)) for key, value in self.__dict__.iteritems())
+
+    def __setstate__(self, state):
+        for key, value in state.iteritems():
+            self.__dict__[key] = self.unpack(value)
+
+    @classmethod
+    def pack(cls, value):
+        if isinstance(value, array):
+            return CompactArray(value)
+        elif isinstance(value, list):
+            return [cls.pack(item) for item in value]
+        return value
+
+    @classmethod
+    def unpack(cls, value):
+        if isinstance(value, CompactArray):
+            return value.to_array()
+        elif isinstance(value, list):
+            return [cls.unpack(item) for item in value]
+        return value
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            cPickle.dump(self, f, cPickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            return cPickle.load(f)
+
+
+class CompactArray(object):
+    def __init__(self, values):
+        self.typecode = values.typecode
+        self.data = values.tostring()
+
+    def to_array(self):
+        values = array(str(self.typecode))
+        values.fromstring(self.data)
+        return values
+
+
+def create_count_array(counts):
+    """
+    Returns an array of unsigned integers just wide enough for the given counts
+    """
+    max_count = max(counts) if counts else 0
+    for typecode in 'BHIL':
+        if max_count < 2 ** (8 * array(str(typecode)).itemsize):
+            return array(str(typecode), counts)
+    raise OverflowError('count %d does not fit in an array' % max_count)
+
+
+def quantize_counts(counts, levels=256):
+    """
+    Maps counts to at most `levels` codes. Returns the codebook, the count represented by each code, and the array
+    of codes. If there are more distinct counts than levels, counts are grouped in logarithmic buckets
+    represented by their mean, so relative errors are similar for small and large counts.
+    """
+    distinct_counts = sorted(set(counts) | {0})
+    if len(distinct_counts) <= levels:
+        code_of_count = dict((count, code) for code, count in enumerate(distinct_counts))
+        return distinct_counts, array(str('B'), [code_of_count[count] for count in counts])
+
+    scale = (levels - 2) / math.log(distinct_counts[-1])
+
+    def get_code(count):
+        if count == 0:
+            return 0
+        return 1 + int(round(math.log(count) * scale))
+
+    bucket_sums = defaultdict(int)
+    bucket_sizes = defaultdict(int)
+    for count in counts:
+        code = get_code(count)
+        bucket_sums[code] += count
+        bucket_sizes[code] += 1
+
+    codebook = [0] * levels
+    for code in bucket_sums:
+        codebook[code] = int(round(bucket_sums[code] / bucket_sizes[code]))
+    return codebook, array(str('B'), [get_code(count) for count in counts])
@@ -3,6 +3,14 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import re
+
+# Lines with characters that are not ASCII or that are line breaks or whitespace for unicode strings but not for byte
+# strings can not be processed as byte strings
+_not_plain_ascii = re.compile(b'[^\x00-\x7f]|[\r\x0b\x0c\x1c-\x1f]')
+_universal_newline = re.compile('\r\n|\r')
+_line = re.compile('[^\n]*\n|[^\n]+')
+
 
 class FileInput(object):
     def __init__(self, fd):
@@ -22,6 +30,24 @@ class FileInput(object):
             line = self.fd.readline()
         except KeyboardInterrupt:
             line = None
-        if line is None or line == "":
+        if not line:
             raise StopIteration
         return line
+
+
+def iter_plain_ascii_lines(lines, universal_newlines=True):
+    """
+    Iterates over the lines of UTF-8 encoded text read as byte strings. Plain ASCII lines are returned as they are read,
+    so that they can be processed without decoding them. Other lines are decoded and split as they would be if the text
+    was read as unicode: with universal newlines, like io.open does, or at every unicode line break, like the codecs
+    readers do
+    """
+    for line in lines:
+        if not _not_plain_ascii.search(line):
+            yield line
+        elif universal_newlines:
+            for text_line in _line.findall(_universal_newline.sub('\n', line.decode('utf-8'))):
+                yield text_line
+        else:
+            for text_line in line.decode('utf-8').splitlines(True):
+                yield text_line
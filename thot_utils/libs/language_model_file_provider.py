@@ -4,12 +4,22 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import abc
+import math
+from array import array
+from bisect import bisect_left
 from collections import defaultdict, Counter
+from itertools import izip
 
-import sqlite3
-
-from nltk import ngrams
+from thot_utils.libs.compact_storage import CompactStorage
+from thot_utils.libs.compact_storage import Vocabulary
+from thot_utils.libs.compact_storage import create_count_array
+from thot_utils.libs.compact_storage import quantize_counts
+from thot_utils.libs.sqlite_storage import SQLiteStorage
 from thot_utils.libs.thot_preproc import lowercase, _global_eos_str, _global_bos_str
+from thot_utils.libs.utils import sqlite_table_exists
+
+# Base of the integer keys of the counted n-grams, the maximum number of distinct words
+_word_id_base = 1 << 31
 
 
 class LanguageModelProviderInterface(object):
@@ -23,56 +33,505 @@ class LanguageModelProviderInterface(object):
     def get_all_counts(self):
         pass
 
+    @abc.abstractmethod
+    def get_logprob(self, ngram):
+        """
+        Returns the precomputed interpolated log-probability of the n-gram or None if it is not stored
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_logprob_interp_prob(self):
+        """
+        Returns the interpolation weight the stored log-probabilities were computed with or None if there are none
+        """
+        pass
+
+    @abc.abstractmethod
+    def is_pruned(self):
+        """
+        Returns whether n-grams were removed from the model when it was built
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_pruned_count(self, history):
+        """
+        Returns the summed counts of the n-grams extending `history` with one word that were pruned from the model
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_all_pruned_counts(self):
+        pass
+
+    @abc.abstractmethod
+    def get_backoff_logprob(self, history):
+        """
+        Returns the precomputed log-weight of the lower order distribution after `history` or None if it is not
+        stored, in which case the weight only depends on the interpolation weight
+        """
+        pass
+
 
 class LanguageModelFileProvider(LanguageModelProviderInterface):
-    def __init__(self, fd, ngrams_length):
+    """
+    Counts the n-grams of a text. Words are replaced by integer ids, starting at 1, and every n-gram is counted under
+    the integer `(...(id_1 * B + id_2) * B + ...) * B + id_n`, with B = `_word_id_base`. Keys of different orders
+    never collide, lower orders have smaller keys, the prefix of an n-gram is `key // B` and 0 is the key of the
+    empty n-gram. The keys of all orders are extracted from the padded ids of a sentence in a single pass and
+    counted in batches of many sentences.
+    """
+
+    def __init__(self, fd, ngrams_length, batch_size=1 << 20):
         self.fd = fd
         self.ngrams_length = ngrams_length
-        self.main_counter = Counter()
+        self.batch_size = batch_size
+        self.words = [None, _global_bos_str, _global_eos_str]
+        self.word_ids = dict((word, word_id) for word_id, word in enumerate(self.words) if word_id)
+        self.left_padding = [self.word_ids[_global_bos_str]] * (ngrams_length - 1)
+        self.right_padding = [self.word_ids[_global_eos_str]] * (ngrams_length - 1)
+        self.total_count = 0
+        self.counts = Counter()
+        self.pruned_counts = Counter()
+        self.batch = []
         self.run()
 
     def run(self):
         for line in self.fd:
             word_array = line.split()
             self.train_word_array(word_array)
+        self.count_batch()
+
+    def get_word_ids(self, word_array):
+        word_ids = map(self.word_ids.get, word_array)
+        if None in word_ids:
+            for i, word in enumerate(word_array):
+                if word_ids[i] is None:
+                    word_id = self.word_ids.get(word)
+                    if word_id is None:
+                        word_id = self.word_ids[word] = len(self.words)
+                        self.words.append(word)
+                    word_ids[i] = word_id
+        return word_ids
 
     def train_word_array(self, word_array):
         # obtain counts for 0-grams
-        self.main_counter.update({"": len(word_array)})
+        self.total_count += len(word_array)
 
-        # obtain counts for higher order n-grams
-        for i in range(1, self.ngrams_length + 1):
-            self.main_counter.update(
-                ngrams(word_array, i, pad_left=True, pad_right=True, left_pad_symbol=_global_bos_str,
-                       right_pad_symbol=_global_eos_str)
-            )
+        # obtain keys for higher order n-grams, the keys of order k are the ones of order k - 1 extended with the
+        # next word. Unigrams are not padded, n-grams of order k are padded with k - 1 symbols on each side
+        batch = self.batch
+        word_ids = self.get_word_ids(word_array)
+        batch.extend(word_ids)
+        padded_ids = self.left_padding + word_ids + self.right_padding
+        keys = padded_ids
+        for order in range(2, self.ngrams_length + 1):
+            keys = [key * _word_id_base + word_id for key, word_id in izip(keys, padded_ids[order - 1:])]
+            batch.extend(keys[self.ngrams_length - order:self.ngrams_length - 1 + len(word_ids)])
+
+        if len(batch) >= self.batch_size:
+            self.count_batch()
+
+    def count_batch(self):
+        self.counts.update(self.batch)
+        del self.batch[:]
+
+    def get_key(self, words):
+        """
+        Returns the key of the n-gram or None if it has unknown words
+        """
+        key = 0
+        for word in words:
+            word_id = self.word_ids.get(word)
+            if word_id is None:
+                return None
+            key = key * _word_id_base + word_id
+        return key
+
+    def get_words(self, key):
+        words = []
+        while key:
+            key, word_id = divmod(key, _word_id_base)
+            words.append(self.words[word_id])
+        words.reverse()
+        return tuple(words)
+
+    @staticmethod
+    def get_order(key):
+        order = 0
+        while key:
+            key //= _word_id_base
+            order += 1
+        return order
+
+    def prune(self, min_counts=None, vocab_size=None):
+        """
+        Removes the n-grams of order k counted less than `min_counts[k - 1]` times (the last value applies to the
+        higher orders) and, if `vocab_size` is given, the n-grams with words out of the `vocab_size` most frequent
+        ones. N-grams that are a prefix of a kept n-gram and the unigrams of its words are always kept, so words
+        that have no unigram are in no n-gram. The counts of the removed n-grams are accumulated per history, so that
+        the language model can give their mass to the lower orders.
+        """
+        self.count_batch()
+        vocabulary = None
+        if vocab_size:
+            unigrams = sorted(((count, self.words[key]) for key, count in self.counts.iteritems()
+                               if key < _word_id_base), reverse=True)
+            vocabulary = set(self.word_ids[word] for _, word in unigrams[:vocab_size])
+            vocabulary.update([self.word_ids[_global_bos_str], self.word_ids[_global_eos_str]])
+
+        # Higher orders have greater keys, so they are visited first
+        kept_prefixes = set()
+        for key in sorted(self.counts, reverse=True):
+            count = self.counts[key]
+            order = self.get_order(key)
+            min_count = min_counts[min(order, len(min_counts)) - 1] if min_counts else 0
+            in_vocabulary = vocabulary is None or self.get_words_in(key, vocabulary)
+            if key in kept_prefixes or (count >= min_count and in_vocabulary):
+                kept_prefixes.add(key // _word_id_base)
+                kept_prefixes.add(key % _word_id_base)
+            else:
+                del self.counts[key]
+                self.pruned_counts[key // _word_id_base] += count
+
+    @staticmethod
+    def get_words_in(key, word_ids):
+        while key:
+            key, word_id = divmod(key, _word_id_base)
+            if word_id not in word_ids:
+                return False
+        return True
 
     def get_count(self, word):
-        return self.main_counter[word]
+        self.count_batch()
+        words = word.split()
+        if not words:
+            return self.total_count
+        key = self.get_key(words)
+        if key is None:
+            return 0
+        return self.counts[key]
 
     def get_all_counts(self):
-        for source, count in self.main_counter.iteritems():
-            yield source, count
+        self.count_batch()
+        yield (), self.total_count
+        for key, count in self.counts.iteritems():
+            yield self.get_words(key), count
+
+    def get_logprob(self, ngram):
+        return None
+
+    def get_logprob_interp_prob(self):
+        return None
+
+    def is_pruned(self):
+        return bool(self.pruned_counts)
 
+    def get_pruned_count(self, history):
+        key = self.get_key(history.split())
+        if key is None:
+            return 0
+        return self.pruned_counts[key]
 
-class LanguageModelDBProvider(LanguageModelProviderInterface):
-    def __init__(self, filename):
-        self.connection = sqlite3.connect(filename)
-        self.cursor = self.connection.cursor()
+    def get_all_pruned_counts(self):
+        for key, count in self.pruned_counts.iteritems():
+            yield self.get_words(key), count
+
+    def get_backoff_logprob(self, history):
+        return None
+
+
+class LanguageModelDBProvider(SQLiteStorage, LanguageModelProviderInterface):
+    """
+    Language model stored in an SQLite file, the keys of the optional Bloom filter are the counted n-grams
+    """
 
     def get_count(self, word):
+        if not self.may_contain(word):
+            return 0
         self.cursor.execute('select c from ngram_counts where n=? limit 1', [word])
         rows = self.cursor.fetchall()
         if rows:
             return rows[0][0]
+        self.record_miss()
         return 0
 
     def get_all_counts(self):
-        raise NotImplemented()
+        for ngram, count in self.connection.execute('select n, c from ngram_counts'):
+            yield tuple(ngram.split()), count
+
+    def get_logprob(self, ngram):
+        # Log-probabilities are stored for every counted n-gram
+        if not self.may_contain(ngram):
+            return None
+        self.cursor.execute('select lp from ngram_logprobs where n=? limit 1', [ngram])
+        rows = self.cursor.fetchall()
+        if rows:
+            return rows[0][0]
+        self.record_miss()
+        return None
+
+    def get_logprob_interp_prob(self):
+        if not sqlite_table_exists(self.connection, 'model_info'):
+            return None
+        self.cursor.execute("select v from model_info where k='interp_prob' limit 1")
+        rows = self.cursor.fetchall()
+        if rows:
+            return float(rows[0][0])
+        return None
+
+    def is_pruned(self):
+        return sqlite_table_exists(self.connection, 'ngram_pruned')
+
+    def get_pruned_count(self, history):
+        self.cursor.execute('select c from ngram_pruned where n=? limit 1', [history])
+        rows = self.cursor.fetchall()
+        if rows:
+            return rows[0][0]
+        return 0
+
+    def get_all_pruned_counts(self):
+        if not self.is_pruned():
+            return
+        for history, count in self.connection.execute('select n, c from ngram_pruned'):
+            yield tuple(history.split()), count
+
+    def get_backoff_logprob(self, history):
+        self.cursor.execute('select lp from ngram_backoffs where n=? limit 1', [history])
+        rows = self.cursor.fetchall()
+        if rows:
+            return rows[0][0]
+        return None
+
+    def get_ngrams_length(self):
+        """
+        Returns the order of the stored model or None if there is no model. The order of models stored before it was
+        recorded is the length of their longest n-grams.
+        """
+        if sqlite_table_exists(self.connection, 'model_info'):
+            self.cursor.execute("select v from model_info where k='ngrams_length' limit 1")
+            rows = self.cursor.fetchall()
+            if rows:
+                return int(rows[0][0])
+        if not sqlite_table_exists(self.connection, 'ngram_counts'):
+            return None
+        self.cursor.execute("select max(length(n) - length(replace(n, ' ', ''))) + 1 from ngram_counts")
+        return self.cursor.fetchall()[0][0]
+
+    def store_ngrams_length(self, ngrams_length):
+        self.connection.execute('CREATE TABLE IF NOT EXISTS model_info (k text primary key not null, v text not null)')
+        self.cursor.execute("insert or replace into model_info values ('ngrams_length', ?)", [str(ngrams_length)])
 
     def load_from_other_provider(self, provider):
         self.connection.execute('CREATE TABLE ngram_counts (n text primary key not null, c int not null)')
         for key, value in provider.get_all_counts():
             self.cursor.execute('insert into ngram_counts values (?, ?)', [' '.join(key), value])
+        if provider.is_pruned():
+            self.connection.execute('CREATE TABLE ngram_pruned (n text primary key not null, c int not null)')
+            for key, value in provider.get_all_pruned_counts():
+                self.cursor.execute('insert into ngram_pruned values (?, ?)', [' '.join(key), value])
+        self.store_ngrams_length(provider.ngrams_length)
         self.connection.commit()
 
+    def update_from_other_provider(self, provider):
+        """
+        Adds the counts of the provider to the stored ones. Stored log-probabilities are dropped, since they depend
+        on every count. The provider has to count n-grams of the order of the stored model.
+        """
+        ngrams_length = self.get_ngrams_length()
+        if ngrams_length is not None and ngrams_length != provider.ngrams_length:
+            raise ValueError('The stored model has n-grams of length %d, the update has n-grams of length %d' % (
+                ngrams_length, provider.ngrams_length))
+        self.connection.execute('CREATE TABLE IF NOT EXISTS ngram_counts (n text primary key not null, c int not null)')
+        counts = [(value, ' '.join(key)) for key, value in provider.get_all_counts()]
+        self.cursor.executemany('insert or ignore into ngram_counts values (?, 0)', [(ngram,) for _, ngram in counts])
+        self.cursor.executemany('update ngram_counts set c = c + ? where n=?', counts)
+        self.store_ngrams_length(provider.ngrams_length)
+        self.invalidate_logprobs()
+        self.connection.commit()
+
+    def get_filter_keys(self):
+        return (ngram for ngram, in self.connection.execute('select n from ngram_counts'))
+
+    def invalidate_logprobs(self):
+        self.connection.execute('DROP TABLE IF EXISTS ngram_logprobs')
+        self.connection.execute('DROP TABLE IF EXISTS ngram_backoffs')
+        if sqlite_table_exists(self.connection, 'model_info'):
+            self.connection.execute("delete from model_info where k='interp_prob'")
+
+    def load_logprobs(self, lmodel):
+        """
+        Stores the interpolated log-probability of every n-gram counted by the provider of `lmodel`, so that decoding
+        with the same interpolation weight only needs lookups and additions
+        """
+        self.connection.execute('CREATE TABLE ngram_logprobs (n text primary key not null, lp real not null)')
+        for key, _ in lmodel.provider.get_all_counts():
+            ngram = ' '.join(key)
+            logprob = math.log(lmodel.obtain_trgsrc_interp_prob(ngram))
+            self.cursor.execute('insert into ngram_logprobs values (?, ?)', [ngram, logprob])
+
+        # Only histories with pruned continuations have a weight other than the default one
+        self.connection.execute('CREATE TABLE ngram_backoffs (n text primary key not null, lp real not null)')
+        for key, _ in lmodel.provider.get_all_pruned_counts():
+            history = ' '.join(key)
+            history_count = lmodel.obtain_ng_count(history)
+            if history_count:
+                logprob = math.log(lmodel.obtain_backoff_weight(history, history_count))
+                self.cursor.execute('insert into ngram_backoffs values (?, ?)', [history, logprob])
+
+        self.connection.execute('CREATE TABLE IF NOT EXISTS model_info (k text primary key not null, v text not null)')
+        self.cursor.execute("insert or replace into model_info values ('interp_prob', ?)", [repr(lmodel.interp_prob)])
+        self.connection.commit()
+
+
+class LanguageModelCompactProvider(CompactStorage, LanguageModelProviderInterface):
+    """
+    Read-only language model stored as a sorted array trie. Words are replaced by their id in the vocabulary and the
+    n-grams of each order are kept sorted by the 64 bit key `prefix_index * len(vocabulary) + word_id`, where
+    `prefix_index` is the position of the n-gram without its newest word in the previous order. Counts are stored in
+    arrays just wide enough for them or, if quantized, as 8 bit codes of a shared codebook. Counts pruned after each
+    history are kept, if there are any, in arrays parallel to the ones of the histories.
+    """
+
+    def __init__(self, quantize=False):
+        self.quantize = quantize
+        self.vocabulary = Vocabulary()
+        self.total_count = 0
+        self.keys = []
+        self.counts = []
+        self.codebook = None
+        self.total_pruned_count = 0
+        self.pruned_counts = []
+
+    def find_ngram(self, words):
+        """
+        Returns the position of the n-gram in the arrays of its order or None if it is not stored
+        """
+        vocabulary_size = len(self.vocabulary)
+        idx = 0
+        for order, word in enumerate(words):
+            if order >= len(self.keys):
+                return None
+            word_id = self.vocabulary.get_id(word)
+            if word_id is None:
+                return None
+            keys = self.keys[order]
+            key = idx * vocabulary_size + word_id
+            idx = bisect_left(keys, key)
+            if idx == len(keys) or keys[idx] != key:
+                return None
+        return idx
+
+    def get_stored_count(self, order, idx):
+        count = self.counts[order][idx]
+        if self.codebook is not None:
+            return self.codebook[count]
+        return count
+
+    def get_count(self, word):
+        words = word.split()
+        if not words:
+            return self.total_count
+        idx = self.find_ngram(words)
+        if idx is None:
+            return 0
+        return self.get_stored_count(len(words) - 1, idx)
+
+    def iterate_ngrams(self):
+        """
+        Yields the order, position and words of every stored n-gram
+        """
+        vocabulary_size = len(self.vocabulary)
+        prefixes = [()]
+        for order, keys in enumerate(self.keys):
+            ngrams = []
+            for idx, key in enumerate(keys):
+                prefix_idx, word_id = divmod(key, vocabulary_size)
+                ngram = prefixes[prefix_idx] + (self.vocabulary.get_word(word_id),)
+                ngrams.append(ngram)
+                yield order, idx, ngram
+            prefixes = ngrams
+
+    def get_all_counts(self):
+        yield (), self.total_count
+
+        for order, idx, ngram in self.iterate_ngrams():
+            count = self.get_stored_count(order, idx)
+            if count:
+                yield ngram, count
+
+    def get_logprob(self, ngram):
+        return None
+
+    def get_logprob_interp_prob(self):
+        return None
+
+    def is_pruned(self):
+        return bool(self.total_pruned_count or self.pruned_counts)
+
+    def get_pruned_count(self, history):
+        words = history.split()
+        if not words:
+            return self.total_pruned_count
+        if len(words) > len(self.pruned_counts):
+            return 0
+        idx = self.find_ngram(words)
+        if idx is None:
+            return 0
+        return self.pruned_counts[len(words) - 1][idx]
+
+    def get_all_pruned_counts(self):
+        if self.total_pruned_count:
+            yield (), self.total_pruned_count
+
+        for order, idx, ngram in self.iterate_ngrams():
+            if order < len(self.pruned_counts) and self.pruned_counts[order][idx]:
+                yield ngram, self.pruned_counts[order][idx]
+
+    def get_backoff_logprob(self, history):
+        return None
+
+    def load_from_other_provider(self, provider):
+        ngram_counts = defaultdict(dict)
+        for key, value in provider.get_all_counts():
+            if key:
+                ngram_counts[len(key)][key] = value
+            else:
+                self.total_count = value
+
+        # Pruned counts of histories that are not stored are useless, those histories have no count either
+        pruned_counts = dict(provider.get_all_pruned_counts())
+        self.total_pruned_count = pruned_counts.pop((), 0)
+        pruned_history_length = max(len(key) for key in pruned_counts) if pruned_counts else 0
+
+        # Every prefix of a stored n-gram needs an entry, with count 0 if it was not counted (e.g. "<bos>")
+        for order in sorted(ngram_counts, reverse=True):
+            for key in ngram_counts[order].keys():
+                prefix = key[:-1]
+                if prefix and prefix not in ngram_counts[order - 1]:
+                    ngram_counts[order - 1][prefix] = 0
+
+        self.vocabulary = Vocabulary(key[-1] for order_counts in ngram_counts.itervalues() for key in order_counts)
+        vocabulary_size = len(self.vocabulary)
+        prefix_positions = {(): 0}
+        for order in range(1, max(ngram_counts) + 1 if ngram_counts else 1):
+            entries = sorted(
+                (prefix_positions[key[:-1]] * vocabulary_size + self.vocabulary.get_id(key[-1]), key, count)
+                for key, count in ngram_counts.pop(order).iteritems()
+            )
+            self.keys.append(array(str('L'), [packed_key for packed_key, _, _ in entries]))
+            self.counts.append([count for _, _, count in entries])
+            if order <= pruned_history_length:
+                self.pruned_counts.append(create_count_array([pruned_counts.get(key, 0) for _, key, _ in entries]))
+            prefix_positions = dict((key, idx) for idx, (_, key, _) in enumerate(entries))
+
+        if self.quantize:
+            counts = [count for order_counts in self.counts for count in order_counts]
+            self.codebook, codes = quantize_counts(counts)
+            offset = 0
+            for order, order_counts in enumerate(self.counts):
+                self.counts[order] = codes[offset:offset + len(order_counts)]
+                offset += len(order_counts)
+        else:
+            self.counts = [create_count_array(order_counts) for order_counts in self.counts]
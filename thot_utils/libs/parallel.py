@@ -0,0 +1,125 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import deque
+from itertools import chain
+from itertools import islice
+
+
+def imap_streaming(func, items, workers=1, max_pending=None):
+    """
+    Applies `func` to every item and yields the results in the order of the items, each one as soon as it and the
+    ones before it are done. With more than one worker, the items are read by another thread and sent one by one to
+    a pool of `workers` processes, so results are not held back while the next item is waited for, as it happens
+    when reading from a pipe. At most `max_pending` items (two per worker by default) are read ahead of the results
+    yielded. `func` must be a module level function so that it can be sent to the workers.
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    # Only imported when needed, it noticeably slows down the startup of the scripts
+    import multiprocessing
+    import Queue
+    import threading
+
+    pool = multiprocessing.Pool(workers)
+    pending = Queue.Queue(max_pending)
+    stopped = threading.Event()
+
+    def read_items():
+        # Every item is followed in the queue by its pending result, the end of the items by None and a reading
+        # error by the exception
+        try:
+            for item in items:
+                if stopped.is_set():
+                    return
+                pending.put(pool.apply_async(func, [item]))
+            pending.put(None)
+        except Exception as e:
+            pending.put(e)
+
+    reader = threading.Thread(target=read_items)
+    # The reader may be blocked reading a pipe when the results are no longer needed
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            result = pending.get()
+            if result is None:
+                break
+            if isinstance(result, Exception):
+                raise result
+            yield result.get()
+        pool.close()
+    finally:
+        # Let a reader blocked on the full queue see that it has to stop
+        stopped.set()
+        while not pending.empty():
+            pending.get_nowait()
+        pool.terminate()
+        pool.join()
+
+
+def process_chunk(func_and_chunk):
+    func, chunk = func_and_chunk
+    return [func(item) for item in chunk]
+
+
+def imap_chunks_ordered(func, items, workers=1, chunksize=1000, max_pending_chunks=None):
+    """
+    Applies `func` to every item and yields the results in the order of the items. With more than one worker, the
+    items are read in chunks of `chunksize` and every chunk is processed in a pool of `workers` processes. At most
+    `max_pending_chunks` chunks (two per worker by default) are read ahead of the results written, so memory does
+    not grow with the number of items. Inputs of no more than two chunks are processed in this process, starting the
+    pool would take longer. `func` must be a module level function so that it can be sent to the workers.
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    chunks = iter_chunks(items, chunksize)
+    first_chunks = list(islice(chunks, 3))
+    if len(first_chunks) <= 2:
+        for chunk in first_chunks:
+            for item in chunk:
+                yield func(item)
+        return
+
+    if max_pending_chunks is None:
+        max_pending_chunks = 2 * workers
+
+    # Only imported when needed, it noticeably slows down the startup of the scripts
+    import multiprocessing
+    pool = multiprocessing.Pool(workers)
+    try:
+        # Chunks are sent as results are taken, the input is not read ahead by the pool
+        pending = deque()
+        for chunk in chain(first_chunks, chunks):
+            pending.append(pool.apply_async(process_chunk, [(func, chunk)]))
+            if len(pending) >= max_pending_chunks:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def iter_chunks(items, chunksize):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunksize))
+        if not chunk:
+            return
+        yield chunk
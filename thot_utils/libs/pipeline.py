@@ -0,0 +1,91 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import threading
+from Queue import Queue
+
+from thot_utils.libs import thot_preproc
+
+_end_of_stream = object()
+
+
+def tokenize_stage(lines):
+    for line in lines:
+        yield ' '.join(thot_preproc.tokenize(line))
+
+
+def lowercase_stage(lines):
+    for line in lines:
+        yield thot_preproc.lowercase(line)
+
+
+def categorize_stage(lines):
+    for line in lines:
+        yield thot_preproc.categorize(line)
+
+
+def create_recase_stage(decoder):
+    def recase_stage(lines):
+        for line in lines:
+            recased_line = decoder.recase_line(line, False)
+            yield line if recased_line is None else recased_line
+
+    return recase_stage
+
+
+class StageError(object):
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class Pipeline(object):
+    """
+    Chains stages, generators that take an iterable of unicode lines and yield the processed lines.
+
+    By default the stages are plain chained generators. With a queue size, every stage runs in its own thread and
+    passes its lines through a bounded queue, so a slow stage blocks the stages that feed it.
+    """
+
+    def __init__(self, stages, queue_size=0):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, lines):
+        if not self.queue_size:
+            for stage in self.stages:
+                lines = stage(lines)
+            return lines
+
+        queue = self.start_thread(lines)
+        for stage in self.stages:
+            queue = self.start_thread(stage(self.iterate_queue(queue)))
+        return self.iterate_queue(queue)
+
+    def start_thread(self, lines):
+        queue = Queue(maxsize=self.queue_size)
+        thread = threading.Thread(target=self.fill_queue, args=(lines, queue))
+        thread.daemon = True
+        thread.start()
+        return queue
+
+    @staticmethod
+    def fill_queue(lines, queue):
+        try:
+            for line in lines:
+                queue.put(line)
+            queue.put(_end_of_stream)
+        except Exception:
+            queue.put(StageError(sys.exc_info()))
+
+    @staticmethod
+    def iterate_queue(queue):
+        while True:
+            item = queue.get()
+            if item is _end_of_stream:
+                return
+            if isinstance(item, StageError):
+                raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+            yield item
@@ -0,0 +1,146 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import threading
+from collections import Counter
+from collections import OrderedDict
+from timeit import default_timer
+
+from thot_utils.libs.language_model_file_provider import LanguageModelProviderInterface
+from thot_utils.libs.translation_model_file_provider import TranslationModelProviderInterface
+
+
+class CallStats(object):
+    """
+    Statistics of the calls made to one provider method: number of calls, queried keys and a latency histogram
+    with power of two buckets in microseconds
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total_time = 0.0
+        self.keys = Counter()
+        self.histogram = Counter()
+
+    def record(self, key, elapsed):
+        self.calls += 1
+        self.total_time += elapsed
+        self.keys[key] += 1
+        self.histogram[self.get_bucket(elapsed)] += 1
+
+    @staticmethod
+    def get_bucket(elapsed):
+        # bucket 0 holds latencies below 1us, bucket i latencies in [2^(i-1), 2^i) us
+        return int(elapsed * 1000000).bit_length()
+
+    @staticmethod
+    def get_bucket_label(bucket):
+        if bucket == 0:
+            return '<1us'
+        return '%d-%dus' % (2 ** (bucket - 1), 2 ** bucket)
+
+    def report(self, top_keys, fd):
+        mean = self.total_time / self.calls if self.calls else 0.0
+        print('%s: %d calls, %d distinct keys, %.3f s total, %.1f us mean' % (
+            self.name, self.calls, len(self.keys), self.total_time, mean * 1000000), file=fd)
+        print('  latency histogram:', file=fd)
+        for bucket in sorted(self.histogram):
+            print('    %12s %d' % (self.get_bucket_label(bucket), self.histogram[bucket]), file=fd)
+        if top_keys:
+            print('  most queried keys:', file=fd)
+        for key, count in self.keys.most_common(top_keys):
+            print(('    %d\t%s' % (count, ' ||| '.join('%s' % part for part in key))).encode('utf-8'), file=fd)
+
+
+class ProviderTracer(object):
+    """
+    Mixin that times the calls forwarded to the wrapped provider and keeps a `CallStats` per method
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.stats = OrderedDict()
+        self.lock = threading.Lock()
+
+    def trace(self, method_name, *args):
+        start = default_timer()
+        result = getattr(self.provider, method_name)(*args)
+        elapsed = default_timer() - start
+
+        with self.lock:
+            stats = self.stats.get(method_name)
+            if stats is None:
+                stats = self.stats[method_name] = CallStats(method_name)
+            stats.record(args, elapsed)
+        return result
+
+    def report(self, top_keys=10, fd=sys.stderr):
+        print('Calls to %s:' % self.provider.__class__.__name__, file=fd)
+        for stats in self.stats.values():
+            stats.report(top_keys, fd)
+        key_filter = getattr(self.provider, 'key_filter', None)
+        if key_filter is not None:
+            key_filter.report(self.provider.__class__.__name__, fd)
+
+
+class TracingLanguageModelProvider(ProviderTracer, LanguageModelProviderInterface):
+    def get_count(self, word):
+        return self.trace('get_count', word)
+
+    def get_all_counts(self):
+        return self.provider.get_all_counts()
+
+    def get_logprob(self, ngram):
+        return self.trace('get_logprob', ngram)
+
+    def get_logprob_interp_prob(self):
+        return self.provider.get_logprob_interp_prob()
+
+    def is_pruned(self):
+        return self.provider.is_pruned()
+
+    def get_pruned_count(self, history):
+        return self.trace('get_pruned_count', history)
+
+    def get_all_pruned_counts(self):
+        return self.provider.get_all_pruned_counts()
+
+    def get_backoff_logprob(self, history):
+        return self.trace('get_backoff_logprob', history)
+
+
+class TracingTranslationModelProvider(ProviderTracer, TranslationModelProviderInterface):
+    def get_targets(self, src_word):
+        return self.trace('get_targets', src_word)
+
+    def get_sorted_targets(self, src_words, max_targets=None):
+        return self.trace('get_sorted_targets', src_words, max_targets)
+
+    def get_target_count(self, src_words, trg_words):
+        return self.trace('get_target_count', src_words, trg_words)
+
+    def get_source_count(self, src_words):
+        return self.trace('get_source_count', src_words)
+
+    def get_all_source_counts(self):
+        return self.provider.get_all_source_counts()
+
+    def get_all_target_counts(self):
+        return self.provider.get_all_target_counts()
+
+    def get_target_logprob(self, src_words, trg_words):
+        return self.trace('get_target_logprob', src_words, trg_words)
+
+    def has_target_logprobs(self):
+        return self.provider.has_target_logprobs()
+
+    def get_max_source_length(self):
+        return self.provider.get_max_source_length()
+
+    def get_source_lengths(self, first_word):
+        return self.trace('get_source_lengths', first_word)
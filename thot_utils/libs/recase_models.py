@@ -0,0 +1,82 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from thot_utils.libs import thot_preproc
+from thot_utils.libs.bloom_filter import load_bloom_filter
+from thot_utils.libs.language_model_file_provider import LanguageModelCompactProvider
+from thot_utils.libs.language_model_file_provider import LanguageModelDBProvider
+from thot_utils.libs.translation_model_file_provider import TranslationModelCompactProvider
+from thot_utils.libs.translation_model_file_provider import TranslationModelDBPrivider
+
+
+def get_db_filename(raw):
+    return '%s.sqlite' % raw
+
+
+def get_tm_filter_filename(raw):
+    return '%s.tm.bloom' % raw
+
+
+def get_lm_filter_filename(raw):
+    return '%s.lm.bloom' % raw
+
+
+def get_compact_tm_filename(raw):
+    return '%s.tm.compact' % raw
+
+
+def get_compact_lm_filename(raw):
+    return '%s.lm.compact' % raw
+
+
+def get_recase_model_filenames(raw, compact=False):
+    if compact:
+        return [get_compact_tm_filename(raw), get_compact_lm_filename(raw)]
+    return [get_db_filename(raw)]
+
+
+def load_recase_providers(raw, compact=False):
+    """
+    Returns the translation and language model providers precalculated from the raw text file
+    """
+    if compact:
+        translation_model_provider = TranslationModelCompactProvider.load(get_compact_tm_filename(raw))
+        language_model_provider = LanguageModelCompactProvider.load(get_compact_lm_filename(raw))
+    else:
+        translation_model_provider = TranslationModelDBPrivider(
+            get_db_filename(raw), load_bloom_filter(get_tm_filter_filename(raw)))
+        language_model_provider = LanguageModelDBProvider(
+            get_db_filename(raw), load_bloom_filter(get_lm_filter_filename(raw)))
+    return translation_model_provider, language_model_provider
+
+
+def create_recase_decoder(translation_model_provider, language_model_provider, ngrams_length=2, interp_prob=None,
+                          cache=None, windowing=False, window_pool=None, future_cost=None,
+                          future_cost_weight=1.0, max_opts=None, opt_threshold=None, max_queue_size=None):
+    tmodel = thot_preproc.TransModel(
+        model_provider=translation_model_provider,
+        max_opts=max_opts,
+        opt_threshold=opt_threshold,
+    )
+    lmodel = thot_preproc.LangModel(language_model_provider, ngrams_length=ngrams_length, interp_prob=interp_prob)
+    weights = [0, 0, 0, 1]
+    return thot_preproc.Decoder(tmodel, lmodel, weights, cache=cache, windowing=windowing,
+                                window_pool=window_pool, future_cost=future_cost, future_cost_weight=future_cost_weight,
+                                max_queue_size=max_queue_size)
+
+
+def evaluate_recasing(decoder, lines):
+    """
+    Recases the lowercased version of every line and returns the number of words recased as in the line and the total
+    number of words
+    """
+    correct = 0
+    total = 0
+    for line in lines:
+        reference = line.split()
+        hypothesis = (decoder.recase_line(thot_preproc.lowercase(line), False) or '').split()
+        correct += sum(1 for ref_word, hyp_word in zip(reference, hypothesis) if ref_word == hyp_word)
+        total += len(reference)
+    return correct, total
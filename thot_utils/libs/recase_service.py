@@ -0,0 +1,104 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import Queue
+import SocketServer
+import stat
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+
+
+class RecaseService(object):
+    """
+    Keeps a decoder loaded once and serves a line protocol: every request line is answered with its recased version,
+    in the same order the requests were received. Up to `concurrency` lines are recased at the same time by the
+    same decoder, and no more than `max_pending` requests (two per line recased at the same time by default) are read
+    ahead of the responses written.
+    """
+
+    def __init__(self, decoder, concurrency=1, max_pending=None):
+        self.concurrency = concurrency
+        self.max_pending = max_pending or 2 * concurrency
+        self.decoder = decoder
+
+    def recase_line(self, line):
+        # Every request is answered: invalid UTF-8 is replaced and lines that can not be recased are sent back as they
+        # are
+        line = line.decode('utf-8', 'replace').strip('\r\n')
+        try:
+            recased_line = self.decoder.recase_line(line, False)
+        except Exception as e:
+            print('Error recasing line %r: %s' % (line, e), file=sys.stderr)
+            recased_line = None
+        if recased_line is None:
+            recased_line = line
+        return recased_line.encode('utf-8')
+
+    def serve(self, in_fd, out_fd):
+        # readline avoids the read-ahead buffer of file iteration, which would hold back pipelined requests
+        requests = iter(in_fd.readline, b'')
+        if self.concurrency == 1:
+            responses = (self.recase_line(line) for line in requests)
+            self.write_responses(responses, out_fd)
+        else:
+            self.serve_concurrently(requests, out_fd)
+
+    def serve_concurrently(self, requests, out_fd):
+        # Responses are written by another thread, so that a client can wait for a response before sending the next
+        # request. Reading stops while `max_pending` requests wait for their response
+        pool = ThreadPool(self.concurrency)
+        pending = Queue.Queue(self.max_pending)
+        write_errors = []
+
+        def write_pending_responses():
+            while True:
+                result = pending.get()
+                if result is None:
+                    return
+                # After a write error the remaining responses are dropped, so that reading is not blocked
+                if not write_errors:
+                    try:
+                        self.write_responses([result.get()], out_fd)
+                    except Exception as e:
+                        write_errors.append(e)
+
+        writer = threading.Thread(target=write_pending_responses)
+        writer.start()
+        try:
+            for line in requests:
+                if write_errors:
+                    break
+                pending.put(pool.apply_async(self.recase_line, [line]))
+        finally:
+            pending.put(None)
+            writer.join()
+            pool.terminate()
+        if write_errors:
+            raise write_errors[0]
+
+    def write_responses(self, responses, out_fd):
+        for response in responses:
+            out_fd.write(response + b'\n')
+            out_fd.flush()
+
+    def serve_unix_socket(self, socket_path):
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.remove(socket_path)
+
+        service = self
+
+        class RequestHandler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                service.serve(self.rfile, self.wfile)
+
+        server = SocketServer.ThreadingUnixStreamServer(socket_path, RequestHandler)
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(socket_path)
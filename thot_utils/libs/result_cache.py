@@ -0,0 +1,99 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import sqlite3
+
+
+def get_model_key(filenames, *settings):
+    """
+    Returns a string identifying a model by its files, their size and modification time, and the decoding settings,
+    so that cached results are not reused after the model or the settings change
+    """
+    parts = []
+    for filename in filenames:
+        file_stat = os.stat(filename)
+        parts.append('%s:%d:%r' % (os.path.abspath(filename), file_stat.st_size, file_stat.st_mtime))
+    parts.extend(repr(setting) for setting in settings)
+    return '|'.join(parts)
+
+
+class ResultCache(object):
+    """
+    Bounded cache of sentence results with least recently used eviction. Entries are keyed by a hash of the model
+    key, the kind of result and the input line. If a filename is given, the entries are loaded from it when the cache
+    is created and saved to it by `save`, so that they are kept between runs.
+    """
+
+    def __init__(self, max_size, model_key='', filename=None):
+        self.max_size = max_size
+        self.model_key = model_key
+        self.filename = filename
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if filename is not None and os.path.exists(filename):
+            self.load()
+
+    def get_key(self, kind, line):
+        return hashlib.sha1(('%s\n%s\n%s' % (self.model_key, kind, line)).encode('utf-8')).hexdigest()
+
+    def get(self, kind, line):
+        """
+        Returns the cached result for the line or None if there is none
+        """
+        key = self.get_key(kind, line)
+        with self.lock:
+            result = self.entries.pop(key, None)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries[key] = result
+            return result
+
+    def put(self, kind, line, result):
+        key = self.get_key(kind, line)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = result
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def load(self):
+        connection = sqlite3.connect(self.filename)
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS results (k text primary key not null, r text not null)')
+            # Rows are stored from the least to the most recently used
+            rows = connection.execute('select k, r from results order by rowid desc limit ?', [self.max_size])
+            for key, result in reversed(rows.fetchall()):
+                self.entries[key] = result
+        finally:
+            connection.close()
+
+    def save(self):
+        if self.filename is None:
+            return
+        connection = sqlite3.connect(self.filename)
+        try:
+            with self.lock:
+                connection.execute('DROP TABLE IF EXISTS results')
+                connection.execute('CREATE TABLE results (k text primary key not null, r text not null)')
+                connection.executemany('insert into results values (?, ?)', self.entries.iteritems())
+            connection.commit()
+        finally:
+            connection.close()
+
+    def report(self, fd=sys.stderr):
+        lookups = self.hits + self.misses
+        print('Result cache: %d lookups, %d hits (%.1f%%), %d entries' % (
+            lookups, self.hits, 100 * self.hits / lookups if lookups else 0.0, len(self.entries)), file=fd)
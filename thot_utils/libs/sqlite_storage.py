@@ -0,0 +1,43 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+
+import sqlite3
+
+
+class SQLiteStorage(object):
+    """
+    Mixin for models stored in an SQLite file. Connections can not be shared between threads, so every thread opens
+    its own one the first time it uses the model and the same model can be queried by decoders in several threads.
+    An optional BloomFilter of the keys of the model lets lookups of missing keys skip the query.
+    """
+
+    def __init__(self, filename, key_filter=None):
+        self.filename = filename
+        self.key_filter = key_filter
+        self.local = threading.local()
+
+    def may_contain(self, key):
+        return self.key_filter is None or self.key_filter.may_contain(key)
+
+    def record_miss(self):
+        # Called when a key that passed the filter is not in the model
+        if self.key_filter is not None:
+            self.key_filter.record_false_positive()
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = sqlite3.connect(self.filename)
+        return connection
+
+    @property
+    def cursor(self):
+        cursor = getattr(self.local, 'cursor', None)
+        if cursor is None:
+            cursor = self.local.cursor = self.connection.cursor()
+        return cursor
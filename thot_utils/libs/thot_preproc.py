@@ -7,7 +7,11 @@ from __future__ import unicode_literals
 import math
 import re
 import sys
-from heapq import heappop, heappush
+import threading
+from heapq import heapify
+from heapq import heappop
+from heapq import heappush
+from itertools import count
 
 _global_n = 2
 _global_lm_interp_prob = 0.5
@@ -23,6 +27,8 @@ _global_digits = re.compile('\d')
 _global_alnum = re.compile('[a-zA-Z0-9]+')
 _global_a_par = 7
 _global_maxniters = 100000
+_global_max_future_lm_states = 64
+_global_max_unknown_words = 1 << 16
 _global_tm_smooth_prob = 0.000001
 
 # xml annotation variables
@@ -37,14 +43,39 @@ len_ann = "length_limit"
 len_patt = u"(<%s>)[ ]*(\d+)[ ]*(</%s>)" % (len_ann, len_ann)
 
 _annotation = re.compile(dic_patt + "|" + len_patt)
+_ascii_annotation = re.compile((dic_patt + "|" + len_patt).encode('ascii'))
+
+# Tokens of plain ASCII byte strings, the same as the ones of Tokenizer: the text between its matches is whitespace
+_ascii_token = re.compile(br'\w+|[^\w\s]+')
 
 
 class TransModel(object):
-    def __init__(self, model_provider):
+    def __init__(self, model_provider, max_opts=None, opt_threshold=None):
         self.model_provider = model_provider
+        self.use_logprobs = model_provider.has_target_logprobs()
+
+        # Option pruning: only the max_opts most probable options of a source are kept, and only those with at least
+        # opt_threshold times the probability of the best one
+        self.max_opts = max_opts
+        self.opt_threshold = opt_threshold
+
+        # Number of words of the longest source, None if the model has no span index
+        self.max_src_length = model_provider.get_max_source_length()
+
+    def obtain_src_lengths(self, first_word):
+        # Returns the numbers of words of the sources starting with the word, the model must have a span index
+        return self.model_provider.get_source_lengths(first_word)
 
     def obtain_opts_for_src(self, src_words):
-        return self.model_provider.get_targets(src_words)
+        if self.max_opts is None and self.opt_threshold is None:
+            return self.model_provider.get_targets(src_words)
+
+        # Targets come sorted by decreasing count, which is proportional to their probability
+        sorted_targets = self.model_provider.get_sorted_targets(src_words, self.max_opts)
+        if self.opt_threshold is not None and len(sorted_targets) > 0:
+            min_count = self.opt_threshold * sorted_targets[0][1]
+            return [target for target, count in sorted_targets if count >= min_count]
+        return [target for target, _ in sorted_targets]
 
     def obtain_srctrg_count(self, src_words, trg_words):
         return self.model_provider.get_target_count(src_words, trg_words)
@@ -65,12 +96,24 @@ class TransModel(object):
             stc = self.obtain_srctrg_count(src_words, trg_words)
             return (1 - _global_tm_smooth_prob) * (float(stc) / float(sc))
 
+    def obtain_trgsrc_logprob_smoothed(self, src_words, trg_words):
+        if self.use_logprobs:
+            lp = self.model_provider.get_target_logprob(src_words, trg_words)
+            if lp is None:
+                # Pairs are stored for every seen source, so the source is unseen
+                return math.log(_global_tm_smooth_prob)
+            return lp
+        else:
+            return math.log(self.obtain_trgsrc_prob_smoothed(src_words, trg_words))
+
     def obtain_src_count(self, src_words):
         return self.model_provider.get_source_count(src_words)
 
     def get_mon_hyp_state(self, hyp):
+        # The empty hypothesis must not share its state with the hypotheses covering the first word, which would be
+        # recombined with it when they have the same language model state
         if len(hyp.data.coverage) == 0:
-            return 0
+            return -1
         else:
             return hyp.data.coverage[len(hyp.data.coverage) - 1]
 
@@ -79,8 +122,24 @@ class LangModel:
     def __init__(self, provider, ngrams_length, interp_prob=None):
         self.provider = provider
         self.ngrams_length = ngrams_length
+        self.pruned = provider.is_pruned()
         self.set_interp_prob(interp_prob or _global_lm_interp_prob)
 
+        # LM states are tuples of word ids, words are given an id the first time they are seen. Ids are only added,
+        # under a lock, so decoders in different threads can share them
+        self.word_ids = {}
+        self.id_words = []
+        self.word_ids_lock = threading.Lock()
+
+        # Words the model has not counted all get the same scores, as every n-gram with one of them has count 0, so
+        # they share the id of the unknown word symbol. That is only possible if the model has not counted the symbol.
+        # The BOS symbol starts n-grams but is not counted as a unigram, so it is given its own id first
+        self.unk_word_id = None
+        self.unknown_words = set()
+        self.get_word_id(_global_bos_str)
+        if provider.get_count(_global_unk_word_str) == 0:
+            self.unk_word_id = self.get_word_id(_global_unk_word_str)
+
     def set_interp_prob(self, interp_prob):
         if interp_prob > 0.99:
             self.interp_prob = 0.99
@@ -89,6 +148,10 @@ class LangModel:
         else:
             self.interp_prob = interp_prob
 
+        # Precomputed log-probabilities can only be used if they were obtained with the same interpolation weight
+        self.use_logprobs = self.provider.get_logprob_interp_prob() == self.interp_prob
+        self.backoff_logprob = math.log(1 - self.interp_prob)
+
     def obtain_ng_count(self, ngram):
         return self.provider.get_count(ngram)
 
@@ -104,14 +167,52 @@ class LangModel:
                 return ngc / hc
 
     def obtain_trgsrc_interp_prob(self, ngram):
+        # Interpolate from the 0-gram up to the whole n-gram
         ng_array = ngram.split()
-        if len(ng_array) == 0:
-            return self.obtain_trgsrc_prob(ngram)
-        else:
-            return self.interp_prob * self.obtain_trgsrc_prob(ngram) + (
-                                                                           1 - self.interp_prob) * \
-                                                                       self.obtain_trgsrc_interp_prob(
-                                                                           self.remove_oldest_word(ngram))
+        prob = self.obtain_trgsrc_prob("")
+        for i in range(len(ng_array) - 1, -1, -1):
+            suffix = ng_array[i:]
+            history = " ".join(suffix[:-1])
+            hc = self.obtain_ng_count(history)
+            if hc == 0:
+                ml_prob = 0
+            else:
+                ml_prob = self.obtain_ng_count(" ".join(suffix)) / hc
+            prob = self.interp_prob * ml_prob + self.obtain_backoff_weight(history, hc) * prob
+        return prob
+
+    def obtain_backoff_weight(self, history, hc):
+        # The mass of the n-grams pruned after the history goes to the lower orders as well, so that the
+        # distribution still adds up to the same amount
+        if hc == 0 or not self.pruned:
+            return 1 - self.interp_prob
+        return (1 - self.interp_prob) + self.interp_prob * self.provider.get_pruned_count(history) / hc
+
+    def obtain_trgsrc_interp_logprob(self, ngram):
+        if not self.use_logprobs:
+            return math.log(self.obtain_trgsrc_interp_prob(ngram))
+
+        # Unseen n-grams get no mass from their own order, so their probability is the one of the shorter n-gram
+        # weighted by the backoff term
+        ng_array = ngram.split()
+        lp = self.provider.get_logprob(ngram)
+        backoff_lp = 0
+        i = 0
+        while lp is None and i < len(ng_array):
+            backoff_lp += self.obtain_backoff_logprob(" ".join(ng_array[i:-1]))
+            i += 1
+            ngram = " ".join(ng_array[i:])
+            lp = self.provider.get_logprob(ngram)
+        if lp is None:
+            return backoff_lp + math.log(self.obtain_trgsrc_interp_prob(ngram))
+        return backoff_lp + lp
+
+    def obtain_backoff_logprob(self, history):
+        if self.pruned:
+            lp = self.provider.get_backoff_logprob(history)
+            if lp is not None:
+                return lp
+        return self.backoff_logprob
 
     def remove_newest_word(self, ngram):
         ng_array = ngram.split()
@@ -137,34 +238,75 @@ class LangModel:
         # Do not alter words
         return trans_raw_word_array
 
+    def get_word_id(self, word):
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            if self.unk_word_id is not None and self.is_unknown_word(word):
+                return self.unk_word_id
+            with self.word_ids_lock:
+                word_id = self.word_ids.get(word)
+                if word_id is None:
+                    word_id = len(self.id_words)
+                    self.id_words.append(word)
+                    self.word_ids[word] = word_id
+        return word_id
+
+    def is_unknown_word(self, word):
+        # Unknown words are remembered in a bounded set, so that the memory of a long running decoder does not grow
+        # with every new word of its input
+        if word in self.unknown_words:
+            return True
+        if self.obtain_ng_count(word) > 0:
+            return False
+        if len(self.unknown_words) >= _global_max_unknown_words:
+            self.unknown_words.clear()
+        self.unknown_words.add(word)
+        return True
+
+    def get_initial_lm_state(self):
+        # Histories shorter than n-1 words are padded on the left with the id -1, which stands for no word
+        return self.extend_lm_state((-1,) * (self.ngrams_length - 1), [_global_bos_str])
+
+    def extend_lm_state(self, lm_state, words_array):
+        # The state is the tuple of the ids of the last n-1 words, including
+        # the BOS symbol
+        if self.ngrams_length <= 1:
+            return ()
+        lm_state = (lm_state + tuple(self.get_word_id(word) for word in words_array))[1 - self.ngrams_length:]
+        if self.unk_word_id is None:
+            return lm_state
+        return self.minimize_lm_state(lm_state)
+
+    def minimize_lm_state(self, lm_state):
+        # Only the longest suffix of the history that was counted matters. Longer histories were not counted, so
+        # they get no mass at their own order and the same backoff weight whatever their oldest words are. These
+        # words are replaced by the unknown word, which was not counted either, so that hypotheses that only differ
+        # in them are recombined. The newest word always has a count, words without one are already unknown
+        unk_word_id = self.unk_word_id
+        start = 0
+        for i, word_id in enumerate(lm_state):
+            if word_id < 0 or word_id == unk_word_id:
+                start = i + 1
+        while start < len(lm_state) - 1 and self.obtain_ng_count(" ".join(self.get_state_words(lm_state[start:]))) == 0:
+            start += 1
+        return tuple(word_id if word_id < 0 else unk_word_id for word_id in lm_state[:start]) + lm_state[start:]
+
+    def get_state_words(self, lm_state):
+        id_words = self.id_words
+        return [id_words[word_id] for word_id in lm_state if word_id >= 0]
+
     def get_lm_state(self, words):
-        # Obtain array of previous words including BOS symbol
-        words_array_aux = words.split()
-        words_array = []
-        words_array.append(_global_bos_str)
-        for i in range(len(words_array_aux)):
-            words_array.append(words_array_aux[i])
-
-        # Obtain history from array
-        len_hwa = len(words_array)
-        hist = ""
-        for i in range(self.ngrams_length - 1):
-            if i < len(words_array):
-                word = words_array[len_hwa - 1 - i]
-                if hist == "":
-                    hist = word
-                else:
-                    hist = word + " " + hist
-        return hist
+        return " ".join(self.get_state_words(self.extend_lm_state(self.get_initial_lm_state(), words.split())))
 
     def get_hyp_state(self, hyp):
-        return self.get_lm_state(hyp.data.words)
+        return hyp.data.lm_state
 
 
 class BfsHypdata:
     def __init__(self):
         self.coverage = []
         self.words = ""
+        self.lm_state = ()
 
     def __str__(self):
         result = "cov:"
@@ -177,24 +319,117 @@ class BfsHypdata:
 class Hypothesis:
     def __init__(self):
         self.score = 0
+        # Estimate of the score of the words still to be covered, hypotheses are sorted by both
+        self.future_cost = 0
         self.data = BfsHypdata()
 
     def __cmp__(self, other):
-        return cmp(other.score, self.score)
+        return cmp(other.score + other.future_cost, self.score + self.future_cost)
 
 
-class PriorityQueue:
-    def __init__(self):
+class IndexedPriorityQueue:
+    """
+    Priority queue of hypotheses holding at most one hypothesis per state. The hypotheses are kept in a binary heap,
+    best first, and the position of every state in the heap is indexed, so a better hypothesis for a state already
+    in the queue replaces the old one in place (decrease-key) and worse ones are never stored. If max_size is given,
+    the queue never holds more hypotheses: when it is full, only the best ones are kept (histogram pruning).
+    """
+
+    def __init__(self, max_size=None):
+        # Entries are lists [(priority, -insertion number), state, hyp], hypotheses with the same priority are taken
+        # in insertion order
         self.heap = []
+        self.positions = {}
+        self.max_size = max_size
+        self.num_insertions = 0
+        self.num_pruned = 0
 
     def empty(self):
         return len(self.heap) == 0
 
-    def put(self, item):
-        heappush(self.heap, item)
+    def __len__(self):
+        return len(self.heap)
+
+    def put(self, state, hyp):
+        # Returns False if the queue already has a hypothesis as good for the state
+        priority = hyp.score + hyp.future_cost
+        pos = self.positions.get(state)
+        if pos is not None:
+            entry = self.heap[pos]
+            if priority <= entry[0][0]:
+                return False
+            entry[0] = (priority, entry[0][1])
+            entry[2] = hyp
+            self.sift_up(pos)
+            return True
+
+        if self.max_size is not None and len(self.heap) >= self.max_size:
+            self.prune()
+        self.num_insertions += 1
+        self.heap.append([(priority, -self.num_insertions), state, hyp])
+        self.sift_up(len(self.heap) - 1)
+        return True
 
     def get(self):
-        return heappop(self.heap)
+        entry = self.heap[0]
+        last_entry = self.heap.pop()
+        del self.positions[entry[1]]
+        if len(self.heap) > 0:
+            self.heap[0] = last_entry
+            self.sift_down(0)
+        return entry[2]
+
+    def peek(self):
+        return self.heap[0][2]
+
+    def prune(self):
+        # Keep the best three quarters of the queue, so that pruning is not repeated on every insertion
+        self.heap.sort(key=lambda entry: entry[0], reverse=True)
+        num_kept = max(1, self.max_size * 3 // 4)
+        for entry in self.heap[num_kept:]:
+            del self.positions[entry[1]]
+        self.num_pruned += len(self.heap) - num_kept
+        del self.heap[num_kept:]
+        # A list sorted best first is a valid heap
+        for pos, entry in enumerate(self.heap):
+            self.positions[entry[1]] = pos
+
+    def sift_up(self, pos):
+        heap = self.heap
+        positions = self.positions
+        entry = heap[pos]
+        key = entry[0]
+        while pos > 0:
+            parent_pos = (pos - 1) >> 1
+            parent = heap[parent_pos]
+            if parent[0] >= key:
+                break
+            heap[pos] = parent
+            positions[parent[1]] = pos
+            pos = parent_pos
+        heap[pos] = entry
+        positions[entry[1]] = pos
+
+    def sift_down(self, pos):
+        heap = self.heap
+        positions = self.positions
+        size = len(heap)
+        entry = heap[pos]
+        key = entry[0]
+        while True:
+            child_pos = 2 * pos + 1
+            if child_pos >= size:
+                break
+            if child_pos + 1 < size and heap[child_pos + 1][0] > heap[child_pos][0]:
+                child_pos += 1
+            child = heap[child_pos]
+            if key >= child[0]:
+                break
+            heap[pos] = child
+            positions[child[1]] = pos
+            pos = child_pos
+        heap[pos] = entry
+        positions[entry[1]] = pos
 
 
 class StateInfoDict:
@@ -212,9 +447,6 @@ class StateInfoDict:
         else:
             self.recomb_map[state_info] = score
 
-    def get(self):
-        return heappop(self.heap)
-
     def hyp_recombined(self, state_info, score):
 
         if state_info in self.recomb_map:
@@ -225,6 +457,11 @@ class StateInfoDict:
         else:
             return False
 
+    def improves(self, state_info, score):
+        # Returns True if no hypothesis as good was found for the state
+        best_score = self.recomb_map.get(state_info)
+        return best_score is None or score > best_score
+
 
 class StateInfo:
     def __init__(self, tm_state, lm_state):
@@ -242,6 +479,137 @@ def obtain_state_info(tmodel, lmodel, hyp):
     return StateInfo(tmodel.get_mon_hyp_state(hyp), lmodel.get_hyp_state(hyp))
 
 
+class SearchGraph:
+    """
+    Graph of the expansions made by the search: every state of an expanded hypothesis is connected to the states of
+    its expansions by arcs with the score and the words they add. Complete states are connected to a final state.
+
+    The best hypotheses are enumerated lazily from the graph (Huang and Chiang, 2005, algorithm 3): every state keeps
+    the sorted list of its best derivations found so far and a heap of candidates, so every extra hypothesis costs a
+    few heap operations.
+    """
+    final_state = StateInfo(None, None)
+
+    def __init__(self, initial_state):
+        self.initial_state = initial_state
+        # Arcs reaching every state, as tuples (previous state, score, words, coverage position)
+        self.arcs = {SearchGraph.final_state: []}
+        self.expanded = set()
+        self.derivations = None
+
+    def start_expansion(self, state):
+        # Returns False if the state was already expanded, its arcs are only recorded once
+        if state in self.expanded:
+            return False
+        self.expanded.add(state)
+        return True
+
+    def add_arc(self, state, hyp, new_state, new_hyp, complete):
+        if hyp.data.words == "":
+            words = new_hyp.data.words
+        else:
+            words = new_hyp.data.words[len(hyp.data.words) + 1:]
+        arcs = self.arcs.get(new_state)
+        if arcs is None:
+            arcs = self.arcs[new_state] = []
+            if complete:
+                self.arcs[SearchGraph.final_state].append((new_state, 0, None, None))
+        arcs.append((state, new_hyp.score - hyp.score, words, new_hyp.data.coverage[-1]))
+        # Derivations have to be found again
+        self.derivations = None
+
+    def find_best_derivations(self):
+        # Derivations are tuples (score, arc, index of the derivation of the previous state). Arcs go from lower to
+        # higher coverage positions, so states are visited in topological order by sorting them by coverage
+        self.derivations = {self.initial_state: [(0, None, None)]}
+        self.candidates = {self.initial_state: []}
+        self.pending = {self.initial_state: True}
+        self.exhausted = set()
+        self.sequence = count()
+        states = sorted((state for state in self.arcs if state != SearchGraph.final_state),
+                        key=lambda state: state.tm_state)
+        states.append(SearchGraph.final_state)
+        for state in states:
+            candidates = [(-(self.derivations[arc[0]][0][0] + arc[1]), next(self.sequence), arc, 0)
+                          for arc in self.arcs[state]]
+            heapify(candidates)
+            self.candidates[state] = candidates
+            if len(candidates) == 0:
+                self.derivations[state] = []
+                self.pending[state] = False
+                self.exhausted.add(state)
+            else:
+                neg_score, _, arc, j = heappop(candidates)
+                self.derivations[state] = [(-neg_score, arc, j)]
+                self.pending[state] = True
+
+    def get_derivation(self, state, k):
+        # Returns the k-th best derivation of the state or None if it has less derivations. Derivations of previous
+        # states are requested through a stack rather than recursively, paths can be longer than the recursion limit
+        stack = [(state, k)]
+        while len(stack) > 0:
+            top_state, top_k = stack[-1]
+            derivations = self.derivations[top_state]
+            if len(derivations) > top_k or top_state in self.exhausted:
+                stack.pop()
+                continue
+            if self.pending[top_state]:
+                # Push the successor of the last derivation found, which uses the next derivation of its previous state
+                _, arc, j = derivations[-1]
+                if arc is not None:
+                    prev_derivations = self.derivations[arc[0]]
+                    if len(prev_derivations) <= j + 1 and arc[0] not in self.exhausted:
+                        stack.append((arc[0], j + 1))
+                        continue
+                    if len(prev_derivations) > j + 1:
+                        heappush(self.candidates[top_state],
+                                 (-(prev_derivations[j + 1][0] + arc[1]), next(self.sequence), arc, j + 1))
+                self.pending[top_state] = False
+            if len(self.candidates[top_state]) == 0:
+                self.exhausted.add(top_state)
+                stack.pop()
+                continue
+            neg_score, _, arc, j = heappop(self.candidates[top_state])
+            derivations.append((-neg_score, arc, j))
+            self.pending[top_state] = True
+
+        derivations = self.derivations[state]
+        if len(derivations) > k:
+            return derivations[k]
+        return None
+
+    def get_hypothesis(self, derivation):
+        arcs = []
+        score, arc, j = derivation
+        while arc is not None:
+            arcs.append(arc)
+            _, arc, j = self.derivations[arc[0]][j]
+
+        hyp = Hypothesis()
+        hyp.score = score
+        for _, _, words, cov_pos in reversed(arcs):
+            if words is None:
+                continue
+            if hyp.data.words == "":
+                hyp.data.words = words
+            else:
+                hyp.data.words = hyp.data.words + " " + words
+            hyp.data.coverage.append(cov_pos)
+        hyp.data.lm_state = arcs[0][0].lm_state
+        return hyp
+
+    def obtain_nblist(self, nblsize):
+        if self.derivations is None:
+            self.find_best_derivations()
+        nblist = []
+        for k in range(nblsize):
+            derivation = self.get_derivation(SearchGraph.final_state, k)
+            if derivation is None:
+                break
+            nblist.append(self.get_hypothesis(derivation))
+        return nblist
+
+
 def transform_word(word):
     if word.isdigit():
         if len(word) > 1:
@@ -324,6 +692,7 @@ def extract_alig_info(hyp_word_array):
     # Initialize output variables
     srcsegms = []
     trgcuts = []
+    srcsegms_found = False
 
     # Scan hypothesis information
     info_found = False
@@ -348,7 +717,6 @@ def extract_alig_info(hyp_word_array):
 
         if trgcuts_found:
             # Obtain source segments
-            srcsegms_found = False
             while i > 0:
                 if hyp_word_array[i] != "|":
                     if i > 3:
@@ -379,6 +747,32 @@ def extract_categ_words_of_segm(word_array, left, right):
     return categ_words
 
 
+def obtain_categ_words_by_categ(word_array, left, right):
+    # Obtain categorized words of the segment grouped by category, in
+    # order of appearance
+    categ_words = {}
+    for i in range(left, min(right + 1, len(word_array))):
+        categ = categorize_word(word_array[i])
+        if is_categ(categ):
+            categ_words.setdefault(categ, []).append(word_array[i])
+    return categ_words
+
+
+def obtain_trg_segm_index(trgcuts, trg_len):
+    # Obtain the index of the segment covering each target position (None
+    # if the position is not covered by any cut)
+    trg_segm_index = [None] * trg_len
+    for k in range(len(trgcuts)):
+        if k == 0:
+            trgleft = 0
+        else:
+            trgleft = trgcuts[k - 1]
+        for trgpos in range(trgleft, min(trgcuts[k], trg_len)):
+            if trg_segm_index[trgpos] is None:
+                trg_segm_index[trgpos] = k
+    return trg_segm_index
+
+
 def decategorize(sline, tline, iline):
     src_word_array = sline.split()
     trg_word_array = tline.split()
@@ -387,83 +781,74 @@ def decategorize(sline, tline, iline):
     # Extract alignment information
     srcsegms, trgcuts = extract_alig_info(hyp_word_array)
 
-    # Iterate over target words
-    output = ""
-    for trgpos in range(len(trg_word_array)):
+    return u' '.join(decategorize_words(src_word_array, trg_word_array, srcsegms, trgcuts))
 
-        if is_categ(trg_word_array[trgpos]):
-            output += decategorize_word(trgpos, src_word_array, trg_word_array, srcsegms, trgcuts)
-        else:
-            output += trg_word_array[trgpos]
 
-        if trgpos < len(trg_word_array) - 1:
-            output += " "
+def decategorize_words(src_word_array, trg_word_array, srcsegms, trgcuts):
+    # Check if there is alignment information available
+    if len(srcsegms) == 0 or len(trgcuts) == 0:
+        return trg_word_array[:]
+
+    trg_segm_index = obtain_trg_segm_index(trgcuts, len(trg_word_array))
+
+    # The n-th categorized word of a target segment is replaced by the n-th
+    # source word of the same category in the aligned source segment
+    src_categ_words = {}
+    categ_order = {}
+    decateg_word_array = []
+    for trgpos in range(len(trg_word_array)):
+        word = trg_word_array[trgpos]
+        k = trg_segm_index[trgpos]
+        if is_categ(word) and k is not None and k < len(srcsegms):
+            if k not in src_categ_words:
+                src_categ_words[k] = obtain_categ_words_by_categ(src_word_array, srcsegms[k][0] - 1,
+                                                                 srcsegms[k][1] - 1)
+            order = categ_order.get((k, word), 0)
+            categ_order[(k, word)] = order + 1
 
-    return output
+            candidates = src_categ_words[k].get(word, [])
+            if order < len(candidates):
+                word = candidates[order]
+        decateg_word_array.append(word)
+
+    return decateg_word_array
 
 
 def decategorize_word(trgpos, src_word_array, trg_word_array, srcsegms, trgcuts):
-    # Check if there is alignment information available
-    if len(srcsegms) == 0 or len(trgcuts) == 0:
-        return trg_word_array[i]
-    else:
-        # Scan target cuts
-        for k in range(len(trgcuts)):
-            if k == 0:
-                if trgpos + 1 <= trgcuts[k]:
-                    trgleft = 0
-                    trgright = trgcuts[k] - 1
-                    break
-            else:
-                if trgpos + 1 > trgcuts[k - 1] and trgpos + 1 <= trgcuts[k]:
-                    trgleft = trgcuts[k - 1]
-                    trgright = trgcuts[k] - 1
-                    break
-        # Check if trgpos'th word was assigned to one cut
-        if k < len(trgcuts):
-            # Obtain source segment limits
-            srcleft = srcsegms[k][0] - 1
-            srcright = srcsegms[k][1] - 1
-            # Obtain categorized words with their indices
-            src_categ_words = extract_categ_words_of_segm(src_word_array, srcleft, srcright)
-            trg_categ_words = extract_categ_words_of_segm(trg_word_array, trgleft, trgright)
-
-            # Obtain decategorized word
-            decateg_word = ""
-            curr_categ_word = trg_word_array[trgpos]
-            curr_categ_word_order = 0
-            for l in range(len(trg_categ_words)):
-                if trg_categ_words[l][0] == trgpos:
-                    break
-                else:
-                    if trg_categ_words[l][1] == curr_categ_word:
-                        curr_categ_word_order += 1
-
-            aux_order = 0
-            for l in range(len(src_categ_words)):
-                if categorize_word(src_categ_words[l][1]) == curr_categ_word:
-                    if aux_order == curr_categ_word_order:
-                        decateg_word = src_categ_words[l][1]
-                        break
-                    else:
-                        aux_order += 1
-
-            # Return decategorized word
-            if decateg_word == "":
-                return trg_word_array[trgpos]
-            else:
-                return decateg_word
-        else:
-            return trg_word_array[trgpos]
+    return decategorize_words(src_word_array, trg_word_array, srcsegms, trgcuts)[trgpos]
 
 
 class Decoder:
-    def __init__(self, tmodel, lmodel, weights):
-        # Initialize data members
+    def __init__(self, tmodel, lmodel, weights, a_par=_global_a_par, max_iters=_global_maxniters, cache=None,
+                 windowing=False, window_pool=None, future_cost=None, future_cost_weight=1.0, max_queue_size=None):
+        # Initialize data members, the decoder is not modified while decoding so it can be used by several threads
         self.tmodel = tmodel
         self.lmodel = lmodel
         self.weights = weights
 
+        # Search parameters: maximum number of words joined in a single expansion and maximum number of expanded
+        # hypotheses
+        self.a_par = a_par
+        self.max_iters = max_iters
+
+        # Optional maximum number of hypotheses in the queue of a search
+        self.max_queue_size = max_queue_size
+
+        # Optional ResultCache of the sentences already processed
+        self.cache = cache
+
+        # Split sentences at unambiguous words and search the windows separately, with the `map` of `window_pool`
+        # if given (e.g. a ThreadPool)
+        self.windowing = windowing
+        self.window_pool = window_pool
+
+        # Optional estimate of the score of the uncovered words added to the score of the hypotheses in the queue
+        # (A* search), either 'admissible' or 'weighted'
+        if future_cost not in (None, 'admissible', 'weighted'):
+            raise ValueError('unknown future cost estimate %r' % future_cost)
+        self.future_cost = future_cost
+        self.future_cost_weight = future_cost_weight
+
         # Checking on weight list
         if len(self.weights) != 4:
             self.weights = [1, 1, 1, 1]
@@ -493,7 +878,7 @@ class Decoder:
 
     def tm_ext_lp(self, new_src_words, opt, verbose):
 
-        lp = math.log(self.tmodel.obtain_trgsrc_prob_smoothed(new_src_words, opt))
+        lp = self.tmodel.obtain_trgsrc_logprob_smoothed(new_src_words, opt)
 
         if verbose == True:
             print >> sys.stderr, "  tm: logprob(", opt.encode("utf-8"), "|", new_src_words.encode("utf-8"), ")=", lp
@@ -531,37 +916,27 @@ class Decoder:
         else:
             return word
 
-    def lm_ext_lp(self, hyp_words, opt, verbose):
+    def lm_ext_lp(self, lm_state, opt, verbose):
         ## Obtain lm history
-        rawhist = self.lmodel.get_lm_state(hyp_words)
-        rawhist_array = rawhist.split()
-        hist = ""
-        for i in range(len(rawhist_array)):
-            word = self.lm_transform_word(rawhist_array[i])
-            if hist == "":
-                hist = word
-            else:
-                hist = hist + " " + word
+        hist = tuple(self.lm_transform_word(word) for word in self.lmodel.get_state_words(lm_state))
 
         # Obtain logprob for new words
         lp = 0
         opt_words_array = opt.split()
         for i in range(len(opt_words_array)):
             word = self.lm_transform_word(opt_words_array[i])
-            if hist == "":
-                ngram = word
-            else:
-                ngram = hist + " " + word
-            lp_ng = math.log(self.lmodel.obtain_trgsrc_interp_prob(ngram))
+            ngram = hist + (word,)
+            lp_ng = self.lmodel.obtain_trgsrc_interp_logprob(" ".join(ngram))
             lp = lp + lp_ng
             if verbose == True:
-                print >> sys.stderr, "  lm: logprob(", word.encode("utf-8"), "|", hist.encode("utf-8"), ")=", lp_ng
+                print >> sys.stderr, "  lm: logprob(", word.encode("utf-8"), "|", " ".join(hist).encode(
+                    "utf-8"), ")=", lp_ng
 
-            hist = self.lmodel.remove_oldest_word(ngram)
+            hist = ngram[1:]
 
         return lp
 
-    def expand(self, tok_array, hyp, new_hyp_cov, verbose):
+    def expand(self, tok_array, hyp, new_hyp_cov, verbose, add_eos=True, future_costs=None):
         # Init result
         exp_list = []
 
@@ -608,6 +983,7 @@ class Decoder:
             else:
                 bfsd_newhyp.words = hyp.data.words
                 bfsd_newhyp.words = bfsd_newhyp.words + " " + opt
+            bfsd_newhyp.lm_state = self.lmodel.extend_lm_state(hyp.data.lm_state, opt.split())
 
             ## Obtain score for new hyp
 
@@ -624,14 +1000,14 @@ class Decoder:
             w_wp_lp = self.weights[self.wpenw_idx] * wp_lp
 
             # Add language model contribution
-            lm_lp = self.lm_ext_lp(hyp.data.words, opt, verbose)
+            lm_lp = self.lm_ext_lp(hyp.data.lm_state, opt, verbose)
             w_lm_lp = self.weights[self.lmw_idx] * lm_lp
 
             # Add language model contribution for <bos> if hyp is
             # complete
             w_lm_end_lp = 0
-            if self.cov_is_complete(bfsd_newhyp.coverage, tok_array):
-                lm_end_lp = self.lm_ext_lp(bfsd_newhyp.words, _global_eos_str, verbose)
+            if add_eos and self.cov_is_complete(bfsd_newhyp.coverage, tok_array):
+                lm_end_lp = self.lm_ext_lp(bfsd_newhyp.lm_state, _global_eos_str, verbose)
                 w_lm_end_lp = self.weights[self.lmw_idx] * lm_end_lp
 
             if verbose == True:
@@ -645,6 +1021,8 @@ class Decoder:
             # Obtain new hypothesis
             newhyp = Hypothesis()
             newhyp.score = hyp.score + w_tm_lp + w_pp_lp + w_wp_lp + w_lm_lp + w_lm_end_lp
+            if future_costs is not None:
+                newhyp.future_cost = future_costs[new_hyp_cov + 1]
             newhyp.data = bfsd_newhyp
 
             # Add expansion to list
@@ -671,29 +1049,247 @@ class Decoder:
         else:
             return False
 
-    def obtain_nblist(self, src_word_array, nblsize, verbose):
-        # Insert initial hypothesis in stack
-        priority_queue = PriorityQueue()
+    def obtain_nblist(self, src_word_array, nblsize, verbose, lm_state=None, add_eos=True):
+        # Insert initial hypothesis in stack, the search can start from a given language model state and leave the
+        # end of sentence unscored when decoding part of a sentence
+        priority_queue = IndexedPriorityQueue(self.max_queue_size)
         hyp = Hypothesis()
-        priority_queue.put(hyp)
+        if lm_state is None:
+            lm_state = self.lmodel.get_initial_lm_state()
+        hyp.data.lm_state = lm_state
+        span_lengths = self.obtain_span_lengths(src_word_array)
+        future_costs = None
+        if self.future_cost is not None:
+            future_costs = self.obtain_future_costs(src_word_array, add_eos, lm_state, span_lengths)
+            hyp.future_cost = future_costs[0]
+        sti = obtain_state_info(self.tmodel, self.lmodel, hyp)
+        priority_queue.put(sti, hyp)
 
         # Create state dictionary
         stdict = StateInfoDict()
-        stdict.insert(obtain_state_info(self.tmodel, self.lmodel, hyp), hyp.score)
-        stdict.insert(obtain_state_info(self.tmodel, self.lmodel, hyp), hyp.score)
+        stdict.insert(sti, hyp.score)
 
-        # Obtain n-best hypotheses
-        nblist = []
-        for i in xrange(nblsize):
-            hyp = self.best_first_search(src_word_array, priority_queue, stdict, verbose)
-
-            # Append hypothesis to nblist
+        # Obtain the best hypothesis
+        if nblsize == 1:
+            hyp = self.best_first_search(src_word_array, priority_queue, stdict, verbose, add_eos, None, future_costs,
+                                         span_lengths)
             if len(hyp.data.coverage) > 0:
-                nblist.append(hyp)
+                return [hyp]
+            return []
+
+        # Obtain n-best hypotheses from the search graph. The search goes on, up to the next complete hypothesis every
+        # time, until no hypothesis left in the queue can be better than the last one of the n-best list, so that all
+        # the paths of the n-best list were expanded
+        graph = SearchGraph(obtain_state_info(self.tmodel, self.lmodel, hyp))
+        nblist = []
+        while True:
+            hyp = self.best_first_search(src_word_array, priority_queue, stdict, verbose, add_eos, graph, future_costs,
+                                         span_lengths)
+            if len(hyp.data.coverage) == 0:
+                # The queue is empty or the search gave up, the graph may have received paths since the last list
+                if len(nblist) > 0:
+                    nblist = graph.obtain_nblist(nblsize)
+                break
+            nblist = graph.obtain_nblist(nblsize)
+            if len(nblist) == nblsize and (priority_queue.empty() or
+                                           priority_queue.peek().score + priority_queue.peek().future_cost <=
+                                           nblist[-1].score):
+                break
 
         # return result
         return nblist
 
+    def obtain_span_lengths(self, src_word_array):
+        # Returns, for every position, the numbers of words of the spans starting there that can have options: the
+        # word itself, which is kept as is if it has none, and the sources of the model starting with the word, up
+        # to a_par words. Every span of up to a_par words is tried if the model has no span index
+        length = len(src_word_array)
+        max_src_length = self.tmodel.max_src_length
+        span_lengths = []
+        for start in range(length):
+            max_span_length = min(self.a_par, length - start)
+            if max_src_length is None:
+                span_lengths.append(range(1, max_span_length + 1))
+            elif max_src_length <= 1 or max_span_length == 1:
+                span_lengths.append([1])
+            else:
+                span_lengths.append([1] + [l for l in self.tmodel.obtain_src_lengths(src_word_array[start])
+                                           if 1 < l <= max_span_length])
+        return span_lengths
+
+    def lm_future_lp(self, opt):
+        # Upper bound of the language model log-probability of the option after any history. Every order above the
+        # unigram interpolates its maximum likelihood estimate, at most 1 with the pruned n-grams included, with the
+        # lower order
+        lp = 0
+        for word in opt.split():
+            prob = math.exp(self.lmodel.obtain_trgsrc_interp_logprob(self.lm_transform_word(word)))
+            for i in range(self.lmodel.ngrams_length - 1):
+                prob = self.lmodel.interp_prob + (1 - self.lmodel.interp_prob) * prob
+            lp += math.log(prob)
+        return lp
+
+    def obtain_future_costs(self, src_word_array, add_eos=True, lm_state=None, span_lengths=None):
+        # Returns, for every position, an upper bound of the score of covering the words from it to the end of the
+        # sentence: the best score of the options of the remaining spans, where the language model is scored with
+        # every state the options can leave before the span. As it never falls below the actual score, the first
+        # complete hypothesis found is still the best one. The weighted estimate scales the bounds by the future cost
+        # weight, which expands fewer hypotheses but may miss the best one
+        length = len(src_word_array)
+        if span_lengths is None:
+            span_lengths = self.obtain_span_lengths(src_word_array)
+        span_opts = {}
+        for start in range(length):
+            for end in [start + l for l in span_lengths[start]]:
+                src_words = " ".join(src_word_array[start:end])
+                opt_list = self.tmodel.obtain_opts_for_src(src_words)
+                if len(opt_list) == 0 and end == start + 1:
+                    opt_list = [src_words]
+                span_opts[start, end] = opt_list
+
+        # Obtain the language model states every position can be reached with, None if there are too many of them
+        if lm_state is None:
+            lm_state = self.lmodel.get_initial_lm_state()
+        lm_states = [set([lm_state])]
+        for end in range(1, length + 1):
+            end_lm_states = set()
+            for start in range(max(0, end - self.a_par), end):
+                if (start, end) not in span_opts:
+                    continue
+                if lm_states[start] is None:
+                    end_lm_states = None
+                    break
+                for opt in span_opts[start, end]:
+                    for start_lm_state in lm_states[start]:
+                        end_lm_states.add(self.lmodel.extend_lm_state(start_lm_state, opt.split()))
+                if len(end_lm_states) > _global_max_future_lm_states:
+                    end_lm_states = None
+                    break
+            lm_states.append(end_lm_states)
+
+        def obtain_lm_lp(start, opt):
+            if lm_states[start] is None:
+                return self.lm_future_lp(opt)
+            return max(self.lm_ext_lp(start_lm_state, opt, False) for start_lm_state in lm_states[start])
+
+        eos_lp = 0
+        if add_eos:
+            eos_lp = self.weights[self.lmw_idx] * obtain_lm_lp(length, _global_eos_str)
+        future_costs = [0] * (length + 1)
+        for start in range(length - 1, -1, -1):
+            best_lp = None
+            for end in [start + l for l in span_lengths[start]]:
+                src_words = " ".join(src_word_array[start:end])
+                for opt in span_opts[start, end]:
+                    lp = self.weights[self.phrpenw_idx] * self.pp_ext_lp(False) + \
+                         self.weights[self.wpenw_idx] * self.wp_ext_lp(opt, False) + \
+                         self.weights[self.lmw_idx] * obtain_lm_lp(start, opt) + \
+                         future_costs[end]
+                    if self.weights[self.tmw_idx] != 0:
+                        lp += self.weights[self.tmw_idx] * self.tm_ext_lp(src_words, opt, False)
+                    if end == length:
+                        lp += eos_lp
+                    if best_lp is None or lp > best_lp:
+                        best_lp = lp
+            future_costs[start] = best_lp
+        if self.future_cost == 'weighted':
+            future_costs = [self.future_cost_weight * lp for lp in future_costs]
+        return future_costs
+
+    def obtain_best_hyp(self, src_word_array, verbose):
+        # Returns the best complete hypothesis or None if none was found
+        if self.windowing:
+            return self.obtain_windowed_hyp(src_word_array, verbose)
+        nblist = self.obtain_nblist(src_word_array, 1, verbose)
+        if len(nblist) == 0:
+            return None
+        return nblist[0]
+
+    def obtain_anchors(self, src_word_array):
+        # Returns the only option of every word that has a single one (or none, and is kept as is) and is not part of
+        # a multi-word source phrase with options, None for the rest of words. Also returns, for every position
+        # between words, whether a multi-word source phrase with options crosses it
+        length = len(src_word_array)
+        in_phrase = [False] * length
+        crossed = [False] * (length + 1)
+        span_lengths = self.obtain_span_lengths(src_word_array)
+        for start in range(length):
+            for end in [start + l for l in span_lengths[start] if l > 1]:
+                if len(self.tmodel.obtain_opts_for_src(" ".join(src_word_array[start:end]))) > 0:
+                    for i in range(start, end):
+                        in_phrase[i] = True
+                    for i in range(start + 1, end):
+                        crossed[i] = True
+
+        anchors = []
+        for i in range(length):
+            opt_list = self.tmodel.obtain_opts_for_src(src_word_array[i])
+            if in_phrase[i] or len(opt_list) > 1:
+                anchors.append(None)
+            elif len(opt_list) == 1:
+                anchors.append(opt_list[0])
+            else:
+                anchors.append(src_word_array[i])
+        return anchors, crossed
+
+    def obtain_windows(self, src_word_array):
+        # Splits the sentence after every n-1 consecutive anchors not crossed by a source phrase. The language model
+        # state after them is the same for every hypothesis, so the windows can be searched separately and the best
+        # hypotheses of the windows make up the best hypothesis of the sentence. Returns the start and end of every
+        # window and the language model state it starts with
+        anchors, crossed = self.obtain_anchors(src_word_array)
+        context_length = self.lmodel.ngrams_length - 1
+        windows = []
+        start = 0
+        lm_state = self.lmodel.get_initial_lm_state()
+        num_anchors = 0
+        for i in range(1, len(src_word_array)):
+            if anchors[i - 1] is None:
+                num_anchors = 0
+            else:
+                num_anchors += 1
+            if num_anchors >= context_length and not crossed[i]:
+                # Options may have no words, the cut is only made if the anchors fill the whole context
+                context = " ".join(anchors[i - num_anchors:i]).split()
+                if len(context) >= context_length:
+                    windows.append((start, i, lm_state))
+                    start = i
+                    lm_state = self.lmodel.extend_lm_state(self.lmodel.get_initial_lm_state(), context)
+        windows.append((start, len(src_word_array), lm_state))
+        return windows
+
+    def obtain_windowed_hyp(self, src_word_array, verbose):
+        windows = self.obtain_windows(src_word_array)
+        if verbose == True:
+            print >> sys.stderr, "*** Searching", len(windows), "windows"
+
+        def search_window(window):
+            start, end, lm_state = window
+            nblist = self.obtain_nblist(src_word_array[start:end], 1, verbose, lm_state,
+                                        add_eos=end == len(src_word_array))
+            if len(nblist) == 0:
+                return None
+            return nblist[0]
+
+        if self.window_pool is not None and len(windows) > 1:
+            window_hyps = self.window_pool.map(search_window, windows)
+        else:
+            window_hyps = map(search_window, windows)
+        if any(window_hyp is None for window_hyp in window_hyps):
+            return None
+
+        # Stitch the hypotheses of the windows together
+        hyp = Hypothesis()
+        for (start, _, _), window_hyp in zip(windows, window_hyps):
+            hyp.score += window_hyp.score
+            hyp.data.coverage.extend(start + pos for pos in window_hyp.data.coverage)
+            if hyp.data.words == "":
+                hyp.data.words = window_hyp.data.words
+            else:
+                hyp.data.words = hyp.data.words + " " + window_hyp.data.words
+        hyp.data.lm_state = window_hyps[-1].data.lm_state
+        return hyp
+
     def obtain_detok_sent(self, tok_array, best_hyp):
 
         # Check if tok_array is not empty
@@ -725,20 +1321,19 @@ class Decoder:
             return ""
 
     def get_hypothesis_to_expand(self, priority_queue, stdict):
+        # Hypotheses are recombined when they are inserted, so the queue only holds the best one of every state
+        if priority_queue.empty() == True:
+            return True, Hypothesis()
+        else:
+            return False, priority_queue.get()
 
-        while True:
-            if priority_queue.empty() == True:
-                return True, Hypothesis()
-            else:
-                hyp = priority_queue.get()
-                sti = obtain_state_info(self.tmodel, self.lmodel, hyp)
-                if stdict.hyp_recombined(sti, hyp.score) == False:
-                    return False, hyp
-
-    def best_first_search(self, src_word_array, priority_queue, stdict, verbose):
+    def best_first_search(self, src_word_array, priority_queue, stdict, verbose, add_eos=True, graph=None,
+                          future_costs=None, span_lengths=None):
         # Initialize variables
         end = False
         niter = 0
+        if span_lengths is None:
+            span_lengths = self.obtain_span_lengths(src_word_array)
 
         if verbose == True:
             print >> sys.stderr, "*** Starting best first search..."
@@ -758,27 +1353,34 @@ class Decoder:
                 if self.hyp_is_complete(hyp, src_word_array) == True:
                     end = True
                 else:
-                    # Expand hypothesis
-                    for l in range(0, _global_a_par):
-                        new_hyp_cov = self.last_cov_pos(hyp.data.coverage) + 1 + l
-                        if new_hyp_cov < len(src_word_array):
-                            # Obtain expansion
-                            exp_list = self.expand(src_word_array, hyp, new_hyp_cov, verbose)
-                            # Insert new hypotheses
-                            for k in range(len(exp_list)):
-                                # Insert hypothesis
-                                priority_queue.put(exp_list[k])
-                                # Update state info dictionary
-                                sti = obtain_state_info(self.tmodel, self.lmodel, exp_list[k])
+                    # Record the expansions of every state once in the search graph, if any
+                    hyp_sti = obtain_state_info(self.tmodel, self.lmodel, hyp)
+                    record = graph is not None and graph.start_expansion(hyp_sti)
+                    # Expand hypothesis with the spans that can have options
+                    start = self.last_cov_pos(hyp.data.coverage) + 1
+                    for l in span_lengths[start]:
+                        new_hyp_cov = start + l - 1
+                        # Obtain expansion
+                        exp_list = self.expand(src_word_array, hyp, new_hyp_cov, verbose, add_eos, future_costs)
+                        # Insert new hypotheses
+                        for k in range(len(exp_list)):
+                            # Insert hypothesis unless a hypothesis as good was found for its state, and update state
+                            # info dictionary
+                            sti = obtain_state_info(self.tmodel, self.lmodel, exp_list[k])
+                            if stdict.improves(sti, exp_list[k].score):
                                 stdict.insert(sti, exp_list[k].score)
+                                priority_queue.put(sti, exp_list[k])
+                            if record:
+                                graph.add_arc(hyp_sti, hyp, sti, exp_list[k],
+                                              self.cov_is_complete(exp_list[k].data.coverage, src_word_array))
 
             niter = niter + 1
 
-            if niter > _global_maxniters:
+            if niter > self.max_iters:
                 end = True
 
         # Return result
-        if niter > _global_maxniters:
+        if niter > self.max_iters:
             if verbose == True:
                 print  >> sys.stderr, "Warning: maximum number of iterations exceeded"
             return Hypothesis()
@@ -796,65 +1398,104 @@ class Decoder:
                                          "hypothesis"
                 return Hypothesis()
 
+    def detokenize_line(self, line, verbose):
+        # Returns the detokenized line or None if no detokenization was found
+        return self.get_cached_result("detokenize", line, self.search_detokenized_line, verbose)
+
+    def search_detokenized_line(self, line, verbose):
+        # Obtain array with tokenized words
+        tok_array = line.split()
+        if verbose == True:
+            print >> sys.stderr, ""
+            print >> sys.stderr, "**** Processing sentence: ", line.encode("utf-8")
+
+        if len(tok_array) > 0:
+            # Transform array of tokenized words
+            trans_tok_array = []
+            for i in range(len(tok_array)):
+                trans_tok_array.append(transform_word(tok_array[i]))
+
+            # Obtain best detokenized sentence
+            best_hyp = self.obtain_best_hyp(trans_tok_array, verbose)
+            if best_hyp is None:
+                return None
+            else:
+                return self.obtain_detok_sent(tok_array, best_hyp)
+        else:
+            return ""
+
     def detokenize(self, file, verbose):
         # read raw file line by line
         lineno = 0
         for line in file:
-            # Obtain array with tokenized words
             lineno = lineno + 1
             line = line.strip("\n")
-            tok_array = line.split()
-            nblsize = 1
-            if verbose == True:
-                print >> sys.stderr, ""
-                print >> sys.stderr, "**** Processing sentence: ", line.encode("utf-8")
-
-            if len(tok_array) > 0:
-                # Transform array of tokenized words
-                trans_tok_array = []
-                for i in range(len(tok_array)):
-                    trans_tok_array.append(transform_word(tok_array[i]))
-
-                # Obtain n-best list of detokenized sentences
-                nblist = self.obtain_nblist(trans_tok_array, nblsize, verbose)
-
-                # Print detokenized sentence
-                if len(nblist) == 0:
-                    print line.encode("utf-8")
-                    print >> sys.stderr, "Warning: no detokenizations were found for sentence in line", lineno
-                else:
-                    best_hyp = nblist[0]
-                    detok_sent = self.obtain_detok_sent(tok_array, best_hyp)
-                    print detok_sent.encode("utf-8")
+            detok_sent = self.detokenize_line(line, verbose)
+
+            # Print detokenized sentence
+            if detok_sent is None:
+                print line.encode("utf-8")
+                print >> sys.stderr, "Warning: no detokenizations were found for sentence in line", lineno
             else:
-                print ""
+                print detok_sent.encode("utf-8")
+
+    def recase_line(self, line, verbose):
+        # Returns the recased line or None if no recased sentence was found
+        return self.get_cached_result("recase", line, self.search_recased_line, verbose)
+
+    def get_cached_result(self, kind, line, search, verbose):
+        if self.cache is None:
+            return search(line, verbose)
+        result = self.cache.get(kind, line)
+        if result is None:
+            result = search(line, verbose)
+            if result is not None:
+                self.cache.put(kind, line, result)
+        return result
+
+    def search_recased_line(self, line, verbose):
+        lc_word_array = line.split()
+        if verbose == True:
+            print >> sys.stderr, ""
+            print >> sys.stderr, "**** Processing sentence: ", line.encode("utf-8")
+
+        if len(lc_word_array) > 0:
+            # Obtain best recased sentence
+            best_hyp = self.obtain_best_hyp(lc_word_array, verbose)
+            if best_hyp is None:
+                return None
+            else:
+                return best_hyp.data.words
+        else:
+            return ""
+
+    def recase_nbest_line(self, line, nblsize, verbose):
+        # Returns a list with the words and the score of the best recased sentences
+        lc_word_array = line.split()
+        if verbose == True:
+            print >> sys.stderr, ""
+            print >> sys.stderr, "**** Processing sentence: ", line.encode("utf-8")
+
+        if len(lc_word_array) > 0:
+            nblist = self.obtain_nblist(lc_word_array, nblsize, verbose)
+            return [(hyp.data.words, hyp.score) for hyp in nblist]
+        else:
+            return [("", 0)]
 
     def recase(self, file, verbose):
         # read raw file line by line
         lineno = 0
         for line in file:
-            # Obtain array with tokenized words
             lineno = lineno + 1
             line = line.strip("\n")
-            lc_word_array = line.split()
-            nblsize = 1
-            if verbose == True:
-                print >> sys.stderr, ""
-                print >> sys.stderr, "**** Processing sentence: ", line.encode("utf-8")
-
-            if len(lc_word_array) > 0:
-                # Obtain n-best list of detokenized sentences
-                nblist = self.obtain_nblist(lc_word_array, nblsize, verbose)
+            recased_line = self.recase_line(line, verbose)
 
-                # Print recased sentence
-                if len(nblist) == 0:
-                    print line.encode("utf-8")
-                    print >> sys.stderr, "Warning: no recased sentences were found for sentence in line", lineno
-                else:
-                    best_hyp = nblist[0]
-                    print best_hyp.data.words.encode("utf-8")
+            # Print recased sentence
+            if recased_line is None:
+                print line.encode("utf-8")
+                print >> sys.stderr, "Warning: no recased sentences were found for sentence in line", lineno
             else:
-                print ""
+                print recased_line.encode("utf-8")
 
 
 class Tokenizer:
@@ -877,6 +1518,22 @@ def tokenize(string):
     return xml_skeleton_to_tokens(skel)
 
 
+def tokenize_ascii(string):
+    """
+    Same as tokenize for a plain ASCII byte string, without decoding it
+    """
+    # Annotations start with a tag
+    if b'<' not in string:
+        return _ascii_token.findall(string)
+    skel = list(annotated_string_to_xml_skeleton(string, _ascii_annotation))
+    for idx, (is_tag, txt) in enumerate(skel):
+        if is_tag:
+            skel[idx][1] = [txt]
+        else:
+            skel[idx][1] = _ascii_token.findall(txt)
+    return xml_skeleton_to_tokens(skel)
+
+
 def xml_skeleton_to_tokens(skeleton):
     """
     Joins back the elements in a skeleton to return a list of tokens
@@ -898,6 +1555,18 @@ def lowercase(string):
     return xml_skeleton_to_string(skel)
 
 
+def lowercase_ascii(string):
+    """
+    Same as lowercase for a plain ASCII byte string, without decoding it
+    """
+    if b'<' not in string:
+        return string.lower().strip()
+    skel = []
+    for is_tag, txt in annotated_string_to_xml_skeleton(string, _ascii_annotation):
+        skel.append(txt.strip() if is_tag else txt.lower().strip())
+    return b" ".join(skel)
+
+
 def xml_skeleton_to_string(skeleton):
     """
     Joins back the elements in a skeleton to return an annotated string
@@ -905,13 +1574,13 @@ def xml_skeleton_to_string(skeleton):
     return u" ".join(txt for _, txt in skeleton)
 
 
-def annotated_string_to_xml_skeleton(annotated):
+def annotated_string_to_xml_skeleton(annotated, annotation=_annotation):
     """
     Parses a string looking for XML annotations
     returns a vector where each element is a pair (is_tag, text)
     """
     offset = 0
-    for m in _annotation.finditer(annotated):
+    for m in annotation.finditer(annotated):
         if offset < m.start():
             yield [False, annotated[offset:m.start()]]
         offset = m.end()
@@ -4,10 +4,20 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import abc
+import math
+from array import array
+from collections import Counter
 from collections import defaultdict
+from itertools import islice
 
-import sqlite3
+from thot_utils.libs.compact_storage import CompactStorage
+from thot_utils.libs.compact_storage import Vocabulary
+from thot_utils.libs.compact_storage import create_count_array
+from thot_utils.libs.sqlite_storage import SQLiteStorage
 from thot_utils.libs.thot_preproc import lowercase
+from thot_utils.libs.thot_preproc import tokenize
+from thot_utils.libs.thot_preproc import transform_word
+from thot_utils.libs.utils import sqlite_table_exists
 
 
 class TranslationModelProviderInterface(object):
@@ -17,6 +27,14 @@ class TranslationModelProviderInterface(object):
     def get_targets(self, src_word):
         pass
 
+    @abc.abstractmethod
+    def get_sorted_targets(self, src_words, max_targets=None):
+        """
+        Returns the pairs (target, count) of the source sorted by decreasing count, only the first `max_targets` if
+        given
+        """
+        pass
+
     @abc.abstractmethod
     def get_target_count(self, src_words, trg_words):
         pass
@@ -33,12 +51,52 @@ class TranslationModelProviderInterface(object):
     def get_all_target_counts(self):
         pass
 
+    @abc.abstractmethod
+    def get_target_logprob(self, src_words, trg_words):
+        """
+        Returns the precomputed smoothed log-probability of the target given the source or None if it is not stored
+        """
+        pass
+
+    @abc.abstractmethod
+    def has_target_logprobs(self):
+        pass
+
+    @abc.abstractmethod
+    def get_max_source_length(self):
+        """
+        Returns the number of words of the longest source or None if the model has no span index
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_source_lengths(self, first_word):
+        """
+        Returns the sorted numbers of words of the sources starting with the word, from the span index of the model
+        """
+        pass
+
+
+def obtain_source_lengths(sources):
+    """
+    Builds the span index of the sources: the sorted numbers of words of the sources starting with every word
+    """
+    source_lengths = defaultdict(set)
+    for source in sources:
+        words = source.split()
+        if words:
+            source_lengths[words[0]].add(len(words))
+    return dict((word, sorted(lengths)) for word, lengths in source_lengths.iteritems())
+
 
 class TranslationModelFileProvider(TranslationModelProviderInterface):
     def __init__(self, fd):
         self.fd = fd
-        self.st_counts = defaultdict(lambda: defaultdict(lambda: 0))
-        self.s_counts = defaultdict(lambda: 0)
+        self.st_counts = defaultdict(Counter)
+        self.s_counts = Counter()
+
+        # Span index, built on the first lookup after the counts change
+        self.source_lengths = None
 
         self.run()
 
@@ -56,12 +114,33 @@ class TranslationModelFileProvider(TranslationModelProviderInterface):
     def increase_count(self, src_words, trg_words, c):
         self.st_counts[src_words][trg_words] += c
         self.s_counts[src_words] += + c
+        self.source_lengths = None
+
+    def prune(self, max_targets):
+        """
+        Keeps only the `max_targets` most frequent targets of every source. Source counts are not changed, so the
+        kept targets have the same probability as before.
+        """
+        for src_words, targets_counts in self.st_counts.iteritems():
+            if len(targets_counts) > max_targets:
+                kept = sorted(targets_counts.iteritems(), key=lambda item: (-item[1], item[0]))[:max_targets]
+                self.st_counts[src_words] = Counter(dict(kept))
 
     def get_targets(self, src_word):
-        return self.st_counts[src_word].keys()
+        # Lookups must not add entries for unseen words
+        if src_word in self.st_counts:
+            return self.st_counts[src_word].keys()
+        return []
+
+    def get_sorted_targets(self, src_words, max_targets=None):
+        if src_words in self.st_counts:
+            return sorted(self.st_counts[src_words].iteritems(), key=lambda item: (-item[1], item[0]))[:max_targets]
+        return []
 
     def get_target_count(self, src_words, trg_words):
-        return self.st_counts[src_words][trg_words]
+        if src_words in self.st_counts:
+            return self.st_counts[src_words][trg_words]
+        return 0
 
     def get_source_count(self, src_words):
         return self.s_counts[src_words]
@@ -75,35 +154,120 @@ class TranslationModelFileProvider(TranslationModelProviderInterface):
             for target, count in targets_counts.iteritems():
                 yield source, target, count
 
+    def get_target_logprob(self, src_words, trg_words):
+        return None
+
+    def has_target_logprobs(self):
+        return False
+
+    def get_span_index(self):
+        if self.source_lengths is None:
+            self.source_lengths = obtain_source_lengths(self.st_counts)
+        return self.source_lengths
+
+    def get_max_source_length(self):
+        return max([lengths[-1] for lengths in self.get_span_index().itervalues()] or [0])
+
+    def get_source_lengths(self, first_word):
+        return self.get_span_index().get(first_word, [])
+
+
+class DetokenizationModelFileProvider(TranslationModelFileProvider):
+    """
+    Counts how tokens are joined in raw text: the source of every raw word is the space separated sequence of its
+    transformed tokens and the target is their concatenation
+    """
+
+    def run(self):
+        for line in self.fd:
+            for raw_word in line.split():
+                trans_tokens = [transform_word(token) for token in tokenize(raw_word)]
+                self.increase_count(" ".join(trans_tokens), "".join(trans_tokens), 1)
+
 
-class TranslationModelDBPrivider(TranslationModelProviderInterface):
-    def __init__(self, filename):
-        self.connection = sqlite3.connect(filename)
-        self.cursor = self.connection.cursor()
+class TranslationModelDBPrivider(SQLiteStorage, TranslationModelProviderInterface):
+    """
+    Translation model stored in an SQLite file, the keys of the optional Bloom filter are the sources
+    """
 
     def get_targets(self, src_word):
+        if not self.may_contain(src_word):
+            return []
         self.cursor.execute('select t from st_counts where s=?', [src_word])
-        return [t for t, in self.cursor.fetchall()]
+        targets = [t for t, in self.cursor.fetchall()]
+        if not targets:
+            self.record_miss()
+        return targets
+
+    def get_sorted_targets(self, src_words, max_targets=None):
+        if not self.may_contain(src_words):
+            return []
+        # Read in order from the st_counts_by_count index if the model has it
+        self.cursor.execute('select t, c from st_counts where s=? order by c desc, t limit ?',
+                            [src_words, -1 if max_targets is None else max_targets])
+        sorted_targets = self.cursor.fetchall()
+        if not sorted_targets:
+            self.record_miss()
+        return sorted_targets
 
     def get_target_count(self, src_words, trg_words):
+        if not self.may_contain(src_words):
+            return 0
         self.cursor.execute('select c from st_counts where s=? and t=? limit 1', [src_words, trg_words])
         rows = self.cursor.fetchall()
         if rows:
             return rows[0][0]
+        self.record_pair_miss(src_words)
         return 0
 
+    def record_pair_miss(self, src_words):
+        # The keys of the filter are the sources, a missing pair is only a false positive if its source is missing
+        if self.key_filter is not None:
+            self.cursor.execute('select 1 from s_counts where t=? limit 1', [src_words])
+            if not self.cursor.fetchall():
+                self.record_miss()
+
     def get_source_count(self, src_words):
+        if not self.may_contain(src_words):
+            return 0
         self.cursor.execute('select c from s_counts where t=? limit 1', [src_words])
         rows = self.cursor.fetchall()
         if rows:
             return rows[0][0]
+        self.record_miss()
         return 0
 
     def get_all_source_counts(self):
-        raise NotImplemented()
+        for source, count in self.connection.execute('select t, c from s_counts'):
+            yield source, count
 
     def get_all_target_counts(self):
-        raise NotImplemented()
+        for source, target, count in self.connection.execute('select s, t, c from st_counts'):
+            yield source, target, count
+
+    def get_target_logprob(self, src_words, trg_words):
+        if not self.may_contain(src_words):
+            return None
+        self.cursor.execute('select lp from st_logprobs where s=? and t=? limit 1', [src_words, trg_words])
+        rows = self.cursor.fetchall()
+        if rows:
+            return rows[0][0]
+        self.record_pair_miss(src_words)
+        return None
+
+    def has_target_logprobs(self):
+        return sqlite_table_exists(self.connection, 'st_logprobs')
+
+    def get_max_source_length(self):
+        # Models stored before the span index was added do not have it
+        if not sqlite_table_exists(self.connection, 'source_lengths'):
+            return None
+        self.cursor.execute('select max(l) from source_lengths')
+        return self.cursor.fetchone()[0] or 0
+
+    def get_source_lengths(self, first_word):
+        self.cursor.execute('select l from source_lengths where w=? order by l', [first_word])
+        return [l for l, in self.cursor.fetchall()]
 
     def load_from_other_provider(self, provider):
         self.connection.execute('CREATE TABLE s_counts (t text primary key not null, c int not null)')
@@ -115,5 +279,158 @@ class TranslationModelDBPrivider(TranslationModelProviderInterface):
             'CREATE TABLE st_counts (s text not null, t text not null, c int not null, PRIMARY KEY(s, t))')
         for source, target, count in provider.get_all_target_counts():
             self.cursor.execute('insert into st_counts values (?, ?, ?)', [source, target, count])
+        self.create_sorted_targets_index()
+        self.create_source_lengths_table()
+        self.connection.commit()
+
+    def create_sorted_targets_index(self):
+        # Keeps the targets of every source sorted by decreasing count
+        self.connection.execute('CREATE INDEX IF NOT EXISTS st_counts_by_count ON st_counts (s, c DESC, t)')
+
+    def create_source_lengths_table(self):
+        # Span index of the stored sources, rebuilt from all of them
+        self.connection.execute('DROP TABLE IF EXISTS source_lengths')
+        self.connection.execute(
+            'CREATE TABLE source_lengths (w text not null, l int not null, PRIMARY KEY(w, l))')
+        source_lengths = obtain_source_lengths(s for s, in self.connection.execute('select distinct s from st_counts'))
+        self.cursor.executemany('insert into source_lengths values (?, ?)',
+                                [(word, length) for word, lengths in source_lengths.iteritems() for length in lengths])
+
+    def update_from_other_provider(self, provider):
+        """
+        Adds the counts of the provider to the stored ones. Stored log-probabilities are dropped, since they depend
+        on the source counts.
+        """
+        self.connection.execute('CREATE TABLE IF NOT EXISTS s_counts (t text primary key not null, c int not null)')
+        counts = [(value, key) for key, value in provider.get_all_source_counts()]
+        self.cursor.executemany('insert or ignore into s_counts values (?, 0)', [(key,) for _, key in counts])
+        self.cursor.executemany('update s_counts set c = c + ? where t=?', counts)
+
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS st_counts '
+            '(s text not null, t text not null, c int not null, PRIMARY KEY(s, t))')
+        counts = [(count, source, target) for source, target, count in provider.get_all_target_counts()]
+        self.cursor.executemany('insert or ignore into st_counts values (?, ?, 0)', [key[1:] for key in counts])
+        self.cursor.executemany('update st_counts set c = c + ? where s=? and t=?', counts)
+        self.create_sorted_targets_index()
+        self.create_source_lengths_table()
+
+        self.invalidate_logprobs()
+        self.connection.commit()
+
+    def invalidate_logprobs(self):
+        self.connection.execute('DROP TABLE IF EXISTS st_logprobs')
+
+    def get_filter_keys(self):
+        return (source for source, in self.connection.execute('select t from s_counts'))
+
+    def load_logprobs(self, tmodel):
+        """
+        Stores the smoothed log-probability of every source/target pair counted by the provider of `tmodel`
+        """
+        self.connection.execute(
+            'CREATE TABLE st_logprobs (s text not null, t text not null, lp real not null, PRIMARY KEY(s, t))')
+        for source, target, _ in tmodel.model_provider.get_all_target_counts():
+            logprob = math.log(tmodel.obtain_trgsrc_prob_smoothed(source, target))
+            self.cursor.execute('insert into st_logprobs values (?, ?, ?)', [source, target, logprob])
         self.connection.commit()
 
+
+class TranslationModelCompactProvider(CompactStorage, TranslationModelProviderInterface):
+    """
+    Read-only translation model stored in flat arrays. The targets of the i-th source of the sorted source vocabulary
+    are the entries source_offsets[i]:source_offsets[i + 1] of target_ids and target_counts, sorted by decreasing
+    count. The span index keeps the lengths of the sources starting with the i-th word of span_words in the entries
+    span_offsets[i]:span_offsets[i + 1] of span_lengths.
+    """
+
+    # Models saved before the span index was added do not have it
+    max_source_length = None
+
+    def __init__(self):
+        self.sources = Vocabulary()
+        self.targets = Vocabulary()
+        self.source_counts = array(str('L'))
+        self.source_offsets = array(str('L'), [0])
+        self.target_ids = array(str('I'))
+        self.target_counts = array(str('L'))
+        self.max_source_length = 0
+        self.span_words = Vocabulary()
+        self.span_offsets = array(str('L'), [0])
+        self.span_lengths = array(str('B'))
+
+    def get_target_range(self, src_words):
+        source_id = self.sources.get_id(src_words)
+        if source_id is None:
+            return xrange(0)
+        return xrange(self.source_offsets[source_id], self.source_offsets[source_id + 1])
+
+    def get_targets(self, src_word):
+        return [self.targets.get_word(self.target_ids[i]) for i in self.get_target_range(src_word)]
+
+    def get_sorted_targets(self, src_words, max_targets=None):
+        # Targets are stored sorted
+        return [(self.targets.get_word(self.target_ids[i]), self.target_counts[i])
+                for i in islice(self.get_target_range(src_words), max_targets)]
+
+    def get_target_count(self, src_words, trg_words):
+        target_id = self.targets.get_id(trg_words)
+        if target_id is not None:
+            for i in self.get_target_range(src_words):
+                if self.target_ids[i] == target_id:
+                    return self.target_counts[i]
+        return 0
+
+    def get_source_count(self, src_words):
+        source_id = self.sources.get_id(src_words)
+        if source_id is None:
+            return 0
+        return self.source_counts[source_id]
+
+    def get_all_source_counts(self):
+        for source_id, source in enumerate(self.sources.words):
+            yield source, self.source_counts[source_id]
+
+    def get_all_target_counts(self):
+        for source_id, source in enumerate(self.sources.words):
+            for i in xrange(self.source_offsets[source_id], self.source_offsets[source_id + 1]):
+                yield source, self.targets.get_word(self.target_ids[i]), self.target_counts[i]
+
+    def get_target_logprob(self, src_words, trg_words):
+        return None
+
+    def has_target_logprobs(self):
+        return False
+
+    def get_max_source_length(self):
+        return self.max_source_length
+
+    def get_source_lengths(self, first_word):
+        word_id = self.span_words.get_id(first_word)
+        if word_id is None:
+            return []
+        return self.span_lengths[self.span_offsets[word_id]:self.span_offsets[word_id + 1]].tolist()
+
+    def load_from_other_provider(self, provider):
+        source_counts = dict(provider.get_all_source_counts())
+        target_counts = defaultdict(list)
+        for source, target, count in provider.get_all_target_counts():
+            target_counts[source].append((-count, target))
+
+        self.sources = Vocabulary(source_counts)
+        self.targets = Vocabulary(target for targets in target_counts.itervalues() for _, target in targets)
+        for source in self.sources.words:
+            self.source_counts.append(source_counts[source])
+            for count, target in sorted(target_counts.pop(source, [])):
+                self.target_ids.append(self.targets.get_id(target))
+                self.target_counts.append(-count)
+            self.source_offsets.append(len(self.target_ids))
+
+        source_lengths = obtain_source_lengths(self.sources.words)
+        self.span_words = Vocabulary(source_lengths)
+        span_lengths = []
+        for word in self.span_words.words:
+            span_lengths.extend(source_lengths[word])
+            self.span_offsets.append(len(span_lengths))
+        self.span_lengths = create_count_array(span_lengths)
+        self.max_source_length = max(span_lengths) if span_lengths else 0
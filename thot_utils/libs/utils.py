@@ -6,3 +6,9 @@ from __future__ import unicode_literals
 
 def split_string_to_words(s):
     return s.strip('\n').strip()
+
+
+def sqlite_table_exists(connection, table_name):
+    cursor = connection.execute("select 1 from sqlite_master where type='table' and name=? limit 1", [table_name])
+    return cursor.fetchone() is not None
+